@@ -5,7 +5,7 @@ from gdcdatamodel import models
 from sqlalchemy import UniqueConstraint
 from sqlalchemy.dialects.postgres import ARRAY, JSONB
 from sqlalchemy import Column, Integer, Text, DateTime
-from sqlalchemy.orm import relationship, joinedload
+from sqlalchemy.orm import relationship, joinedload, load_only
 from psqlgraph import Base
 from sqlalchemy import ForeignKey
 from multiprocessing import Pool
@@ -59,7 +59,7 @@ class OldNode(Base):
 
 
 def translate_node_range(_args):
-    args, offset = _args
+    args, (first, last) = _args
     src = PsqlGraphDriver(
         args.source_host, args.source_user, args.source_password,
         args.source, **driver_kwargs)
@@ -68,10 +68,9 @@ def translate_node_range(_args):
         args.dest, **driver_kwargs)
     with src.session_scope() as session:
         with dst.session_scope() as session:
-            for old in src.nodes(OldNode).order_by(OldNode.node_id)\
-                                         .offset(offset)\
-                                         .limit(BLOCK)\
-                                         .yield_per(BLOCK):
+            for old in src.nodes(OldNode)\
+                          .filter(OldNode.node_id.between(first, last))\
+                          .yield_per(BLOCK):
 
                 try:
                     new = PolyNode(
@@ -99,15 +98,17 @@ def translate_nodes(args):
         args.source_host, args.source_user, args.source_password,
         args.source, **driver_kwargs)
     with src.session_scope():
-        count = src.nodes(OldNode).count()
-    offsets = [i*BLOCK for i in range(count/BLOCK+1)]
+        ranges = [(page[0].node_id, page[-1].node_id)
+                  for page in src.nodes(OldNode)
+                                 .options(load_only('node_id'))
+                                 .iter_pages(BLOCK)]
     pool = Pool(args.nprocs)
-    args = [(args, offset) for offset in offsets]
+    args = [(args, node_range) for node_range in ranges]
     pool.map_async(translate_node_range, args).get(int(1e9))
 
 
 def translate_edge_range(_args):
-    args, offset = _args
+    args, (first, last) = _args
     src = PsqlGraphDriver(
         args.source_host, args.source_user, args.source_password,
         args.source, **driver_kwargs)
@@ -115,18 +116,15 @@ def translate_edge_range(_args):
         args.dest_host, args.dest_user, args.dest_password,
         args.dest, **driver_kwargs)
 
-    print '{}-{}'.format(offset, offset+BLOCK)
+    print '{}-{}'.format(first, last)
     sys.stdout.flush()
     with src.session_scope() as session:
         with dst.session_scope() as session:
             for old in src.edges(OldEdge)\
-                          .order_by((OldEdge.src_id),
-                                    (OldEdge.dst_id),
-                                    (OldEdge.label))\
+                          .filter(OldEdge.key.between(first, last))\
                           .options(joinedload(OldEdge.src))\
                           .options(joinedload(OldEdge.dst))\
-                          .offset(offset)\
-                          .limit(BLOCK).all():
+                          .all():
                 try:
                     Type = dst.get_edge_by_labels(
                         old.src.label, old.label, old.dst.label)
@@ -156,11 +154,13 @@ def translate_edges(args):
         args.source_host, args.source_user, args.source_password,
         args.source, **driver_kwargs)
     with src.session_scope():
-        count = src.nodes(OldEdge).count()
+        ranges = [(page[0].key, page[-1].key)
+                  for page in src.edges(OldEdge)
+                                 .options(load_only('key'))
+                                 .iter_pages(BLOCK, key=OldEdge.key)]
     src.engine.dispose()
-    offsets = [i*BLOCK for i in range(count/BLOCK+1)]
     pool = Pool(args.nprocs)
-    args = [(args, offset) for offset in offsets]
+    args = [(args, key_range) for key_range in ranges]
     pool.map_async(translate_edge_range, args).get(int(1e9))
 
 
@@ -1,8 +1,13 @@
 from psqlgraph import *
+from async_driver import AsyncPsqlGraphDriver
 from node import Node, PolyNode
 from edge import Edge, PolyEdge
 from util import sanitize
 from base import create_all
+from cache import QueryCache, TableVersions, SharedTableVersions
+from label_index import create_node_label_index
+from pool import InstrumentedQueuePool
+from records import NodeRecord, EdgeRecord
 from voided_node import VoidedNode
 from voided_edge import VoidedEdge
 import psqlgraph2neo4j
@@ -0,0 +1,141 @@
+"""
+Non-blocking driver variant
+
+Python 2 and the psycopg2/SQLAlchemy stack used here have no asyncio
+support, so operations are instead run on a fixed-size pool of worker
+threads.  Each call returns immediately with an AsyncResult, which
+lets an event loop (or any caller) issue many concurrent graph
+lookups without a thread, a session and a connection per request.
+
+"""
+from multiprocessing.pool import ThreadPool
+from edge import Edge
+from node import Node
+from psqlgraph import PsqlGraphDriver
+
+
+class AsyncPsqlGraphDriver(object):
+    """Runs PsqlGraphDriver operations on a bounded pool of worker
+    threads.
+
+    Every operation runs in its own session scope on a worker, so it
+    is committed (or rolled back) before its result is made
+    available.  Returned entities are detached from their session:
+    columns are loaded, but relationships that were not loaded inside
+    the operation can no longer be lazy loaded.
+
+    .. code-block:: python
+
+        g = AsyncPsqlGraphDriver(host, user, password, database)
+        pending = g.nodes(Test, lambda q: q.ids(node_id).path('foos'))
+        ...
+        foos = pending.get()
+
+    """
+
+    def __init__(self, host, user, password, database, workers=10,
+                 **kwargs):
+        """Create an async Postgresql Graph Driver
+
+        :param int workers:
+            The number of worker threads, which is also the maximum
+            number of connections used concurrently.  All other
+            keyword arguments are passed to :class:`PsqlGraphDriver`.
+
+        """
+
+        kwargs.setdefault('pool_size', workers)
+        self.driver = PsqlGraphDriver(host, user, password, database,
+                                      **kwargs)
+        self.workers = ThreadPool(workers)
+
+    def close(self):
+        """Wait for pending operations and stop the worker threads
+
+        """
+        self.workers.close()
+        self.workers.join()
+        self.driver.engine.dispose()
+
+    def _run(self, fn, *args, **kwargs):
+        with self.driver.session_scope():
+            return fn(*args, **kwargs)
+
+    def session_scope(self, fn, *args, **kwargs):
+        """Call ``fn(driver, *args, **kwargs)`` inside a new session scope
+        on a worker thread.
+
+        :returns: An AsyncResult for the return value of `fn`
+
+        """
+        return self.workers.apply_async(
+            self._run, (fn, self.driver) + args, kwargs)
+
+    def _query(self, query, filters, loader):
+        query = filters(query) if filters else query
+        return loader(query)
+
+    def nodes(self, query=Node, filters=None):
+        """Run a node query on a worker thread.
+
+        :param query: The entity to query, see :func:`PsqlGraphDriver.nodes`
+        :param filters:
+            Optional function taking and returning a GraphQuery,
+            e.g. ``lambda q: q.props(key='value')``
+        :returns: An AsyncResult for the list of results
+
+        """
+        return self.session_scope(
+            lambda g: self._query(g.nodes(query), filters, list))
+
+    def edges(self, query=Edge, filters=None):
+        """Run an edge query on a worker thread. See :func:`nodes`.
+
+        """
+        return self.session_scope(
+            lambda g: self._query(g.edges(query), filters, list))
+
+    def count(self, query=Node, filters=None):
+        """Count the results of a node or edge query on a worker thread.
+
+        :returns: An AsyncResult for the count
+
+        """
+        return self.session_scope(lambda g: self._query(
+            g.nodes(query), filters, lambda q: q.count()))
+
+    def node_lookup(self, *args, **kwargs):
+        """See :func:`PsqlGraphDriver.node_lookup`
+
+        :returns: An AsyncResult for the list of matching nodes
+
+        """
+        return self.session_scope(
+            lambda g: g.node_lookup(*args, **kwargs).all())
+
+    def node_lookup_one(self, *args, **kwargs):
+        """See :func:`PsqlGraphDriver.node_lookup_one`
+
+        :returns: An AsyncResult for the node or None
+
+        """
+        return self.session_scope(
+            lambda g: g.node_lookup_one(*args, **kwargs))
+
+    def edge_lookup(self, *args, **kwargs):
+        """See :func:`PsqlGraphDriver.edge_lookup`
+
+        :returns: An AsyncResult for the list of matching edges
+
+        """
+        return self.session_scope(
+            lambda g: g.edge_lookup(*args, **kwargs).all())
+
+    def node_merge(self, *args, **kwargs):
+        """See :func:`PsqlGraphDriver.node_merge`
+
+        :returns: An AsyncResult for the merged node
+
+        """
+        return self.session_scope(
+            lambda g: g.node_merge(*args, **kwargs))
@@ -5,12 +5,70 @@ class PropertiesDictError(Exception):
     pass
 
 
-class SystemAnnotationDict(dict):
+class CachedView(object):
+    """Mixin for the dict proxies of a JSONB column.  The proxy of an
+    instance is built on first access and cached on the instance
+    until the column is assigned a different dict or a property is
+    set, so repeated reads do not rebuild it.  Proxies already handed
+    out keep their values when the instance is written to.
+
+    """
+
+    # Name of the proxied column and of the instance attribute holding
+    # the cached proxy
+    _column = None
+    _cache_attr = None
+
+    @classmethod
+    def cached(cls, source):
+        """Returns the cached proxy of `source`, building it if the column
+        has changed since it was cached
+
+        """
+        if isinstance(source, type):
+            return cls(source)
+        view = source.__dict__.get(cls._cache_attr)
+        column = getattr(source, cls._column)
+        if view is None or view._source_column is not column:
+            view = cls(source)
+            view._source_column = column
+            source.__dict__[cls._cache_attr] = view
+        return view
+
+    def _detach(self):
+        """Stop using this proxy as the cached one, for changes that are
+        not written through to the column.
+
+        """
+        if self.source.__dict__.get(self._cache_attr) is self:
+            del self.source.__dict__[self._cache_attr]
+
+    def pop(self, *args):
+        self._detach()
+        return super(CachedView, self).pop(*args)
+
+    def popitem(self):
+        self._detach()
+        return super(CachedView, self).popitem()
+
+    def setdefault(self, *args):
+        self._detach()
+        return super(CachedView, self).setdefault(*args)
+
+    def clear(self):
+        self._detach()
+        return super(CachedView, self).clear()
+
+
+class SystemAnnotationDict(CachedView, dict):
     """Transparent wrapper for _sysan so you can update it as
     if it were a dict and the changes get pushed to the sqlalchemy object
 
     """
 
+    _column = '_sysan'
+    _cache_attr = '_system_annotations_view'
+
     def __init__(self, source):
         self.source = source
         super(SystemAnnotationDict, self).__init__(sanitize(source._sysan))
@@ -35,12 +93,15 @@ class SystemAnnotationDict(dict):
         self.update()
 
 
-class PropertiesDict(dict):
+class PropertiesDict(CachedView, dict):
     """Transparent wrapper for _props so you can update it as
     if it were a dict and the changes get pushed to the sqlalchemy object
 
     """
 
+    _column = '_props'
+    _cache_attr = '_properties_view'
+
     def __init__(self, source):
         self.source = source
         super(PropertiesDict, self).__init__(
@@ -1,10 +1,12 @@
 from attributes import PropertiesDict, SystemAnnotationDict
-from sqlalchemy import Column, Text, DateTime, text, event
+from sqlalchemy import Column, Text, DateTime, text, event, cast, Index
+from sqlalchemy import BigInteger, Float, Boolean
 from sqlalchemy.dialects.postgres import ARRAY, JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import object_session, sessionmaker
+from sqlalchemy.orm import object_session, sessionmaker, configure_mappers
+from sqlalchemy.orm.attributes import instance_state
 from sqlalchemy.orm.util import polymorphic_union
 from util import sanitize, validate
 
@@ -12,6 +14,64 @@ from util import sanitize, validate
 abstract_classes = ['Node', 'Edge', 'Base']
 NODE_TABLENAME_SCHEME = 'node_{class_name}'
 EDGE_TABLENAME_SCHEME = 'edge_{class_name}'
+PROPERTY_INDEX_SCHEME = '{tablename}__props_{key}_idx'
+
+# The postgres types that property values are cast to for comparison,
+# by python type
+PROPERTY_TYPES = {
+    int: BigInteger,
+    long: BigInteger,
+    float: Float,
+    bool: Boolean,
+    str: Text,
+    unicode: Text,
+}
+
+
+def property_type(type_):
+    """Returns a SQLAlchemy type instance for `type_`, which is either a
+    python type from :data:`PROPERTY_TYPES` or a SQLAlchemy type
+
+    """
+    type_ = PROPERTY_TYPES.get(type_, type_)
+    return type_() if isinstance(type_, type) else type_
+
+
+def common_property_type(types):
+    """Returns a SQLAlchemy type instance that values of all the python
+    `types` can be cast to, or None if there is none.
+
+    """
+    return widen_property_types(
+        PROPERTY_TYPES.get(type_, Text) for type_ in types)
+
+
+def widen_property_types(types):
+    """Returns an instance of the SQLAlchemy type that covers all the
+    SQLAlchemy type classes `types`, or None if there is none.  Mixes
+    of BigInteger and Float widen to Float, other mixes have no common
+    type.
+
+    """
+    types = set(types)
+    if len(types) == 1:
+        return types.pop()()
+    if types and types <= {BigInteger, Float}:
+        return Float()
+    return None
+
+
+def property_expression(column, key, type_):
+    """Returns the expression comparing property `key` of the JSONB
+    `column` as `type_`.  This is the expression that indexed
+    properties are indexed on, so filters must use it to be able to
+    use the index.
+
+    """
+    value = column[key].astext
+    if isinstance(type_, Text):
+        return value
+    return cast(value, type_)
 
 
 class CommonBase(object):
@@ -20,10 +80,11 @@ class CommonBase(object):
     _session_hooks_before_update = []
     _session_hooks_before_delete = []
     # These cache properties are used to speed up
-    # get_property_list() because checking for hybrid_property
-    # is very expensive
-    _properties_list_full_cache = None
+    # get_property_list() and has_property() because checking for
+    # hybrid_property is very expensive.  They are set per class and
+    # reset when the hybrid properties are created.
     _properties_list_cache = None
+    _properties_set_cache = None
 
     # ======== Columns ========
     created = Column(
@@ -76,10 +137,19 @@ class CommonBase(object):
     def __init__(self, *args, **kwargs):
         raise NotImplemented()
 
+    def __getstate__(self):
+        # The cached property views and the _props clone marker are
+        # rebuilt on demand, see PropertiesDict and _set_property
+        state = self.__dict__.copy()
+        for key in ('_properties_view', '_system_annotations_view',
+                    '_props_clone'):
+            state.pop(key, None)
+        return state
+
     # ======== Properties ========
     @hybrid_property
     def properties(self):
-        return PropertiesDict(self)
+        return PropertiesDict.cached(self)
 
     @properties.setter
     def properties(self, properties):
@@ -124,11 +194,24 @@ class CommonBase(object):
         """Property dict is cloned (to make sure that SQLAlchemy flushes it)
         before setting the key value pair.
 
+        The clone is only made on the first change since the instance
+        was loaded or flushed.  Until the next flush SQLAlchemy keeps
+        the original dict as the committed value, so later changes
+        are made to the clone in place, which keeps setting N
+        properties O(N) instead of O(N^2).  Other instances never
+        share the clone, see :func:`own_props`.
+
         """
         if not self.has_property(key):
             raise KeyError('{} has no property {}'.format(type(self), key))
-        self._props = {k: v for k, v in self._props.iteritems()}
+        if self._props is not self.__dict__.get('_props_clone') \
+           or '_props' not in instance_state(self).committed_state:
+            self._props_clone = dict(self._props)
+            self._props = self._props_clone
         self._props[key] = val
+        # Drop the cached properties view, references to it that are
+        # already held keep the values they had, see PropertiesDict
+        self.__dict__.pop('_properties_view', None)
 
     def _get_property(self, key):
         """If the property is defined in the model but not present on the
@@ -168,14 +251,14 @@ class CommonBase(object):
         """Returns a list of hybrid_properties defined on the subclass model
 
         """
-        if not cls._properties_list_cache or not set(cls.__dict__) == cls._properties_list_full_cache:
-            cls._properties_list_full_cache = set(cls.__dict__)
+        if cls.__dict__.get('_properties_list_cache') is None:
             cls._properties_list_cache = [
                 attr for attr in dir(cls)
                 if attr in cls.__dict__
                 and isinstance(cls.__dict__[attr], hybrid_property)
                 and getattr(getattr(cls, attr), '_is_pg_property', True)
             ]
+            cls._properties_set_cache = frozenset(cls._properties_list_cache)
         return cls._properties_list_cache
 
     @classmethod
@@ -183,7 +266,8 @@ class CommonBase(object):
         """Returns boolean if key is a property defined on the subclass model
 
         """
-        return key in cls.get_property_list()
+        cls.get_property_list()
+        return key in cls._properties_set_cache
 
     # ======== Label ========
     @hybrid_property
@@ -213,7 +297,7 @@ class CommonBase(object):
         column.
 
         """
-        return SystemAnnotationDict(self)
+        return SystemAnnotationDict.cached(self)
 
     @system_annotations.setter
     def system_annotations(self, sysan):
@@ -278,6 +362,19 @@ class CommonBase(object):
                 "Null value in key '{}' violates non-null constraint for {}."
             ).format(key, self)
 
+    def _validate_properties(self):
+        """Run the pg_property type and enum checks against the current
+        contents of _props.  The property setters do this on
+        assignment, this is for code paths (e.g. bulk loading) that
+        write rows without going through the setters.
+
+        """
+        for key, value in self._props.iteritems():
+            fset = self.__pg_setters__.get(key)
+            if fset is None:
+                raise KeyError('{} has no property {}'.format(type(self), key))
+            validate(fset, value, fset.__pg_types__, fset.__pg_enum__)
+
     @classmethod
     def get_pg_properties(cls):
         return cls.__pg_properties__
@@ -307,6 +404,12 @@ def create_hybrid_properties(mapper, cls):
     # dictionary.  It will be populated at mapper configuration using
     # all model properties defined with @pg_property
     cls.__pg_properties__ = {}
+    # The original setter functions, kept so that the type and enum
+    # checks can be re-run without going through the setters
+    cls.__pg_setters__ = {}
+    # Property name to the SQLAlchemy type of the index on it, for
+    # properties declared with @pg_property(indexed=...)
+    cls.__pg_indexes__ = {}
 
     for pg_attr in dir(cls):
         if pg_attr in ['properties', 'props', 'system_annotations', 'sysan']:
@@ -319,6 +422,47 @@ def create_hybrid_properties(mapper, cls):
         h_prop = create_hybrid_property(pg_attr, f)
         setattr(cls, pg_attr, h_prop)
         cls.__pg_properties__[pg_attr] = f.__pg_types__
+        cls.__pg_setters__[pg_attr] = f
+        if getattr(f, '__pg_indexed__', False):
+            create_property_index(cls, pg_attr, f)
+
+    # The property list changed, see get_property_list()
+    cls._properties_list_cache = None
+
+
+@event.listens_for(CommonBase, 'mapper_configured', propagate=True)
+def listen_props_set(mapper, cls):
+    event.listen(cls._props, 'set', own_props, retval=True)
+
+
+def own_props(target, value, oldvalue, initiator):
+    """Copies a dict assigned to `_props` unless it is the instance's own
+    clone, so that the clone edited in place by
+    :func:`CommonBase._set_property` is never shared with another
+    instance, e.g. when ``session.merge()`` copies `_props` onto the
+    persistent instance.
+
+    """
+    if value is None or value is target.__dict__.get('_props_clone'):
+        return value
+    return dict(value)
+
+
+def create_property_index(cls, key, fset):
+    if fset.__pg_indexed__ is True:
+        types = fset.__pg_types__ or (str,)
+        type_ = common_property_type(types)
+        if type_ is None:
+            raise ValueError((
+                "Property {}.{} declares types {} that cannot be indexed "
+                "as one type, pass the index type as indexed=<type>."
+            ).format(cls.__name__, key, types))
+    else:
+        type_ = property_type(fset.__pg_indexed__)
+    cls.__pg_indexes__[key] = type_
+    Index(PROPERTY_INDEX_SCHEME.format(
+        tablename=cls.__tablename__, key=key),
+        property_expression(cls.__table__.c._props, key, type_))
 
 
 class VoidedBaseClass(object):
@@ -357,5 +501,8 @@ ORMBase = declarative_base(cls=CommonBase)
 
 
 def create_all(engine):
+    # Property indexes are added to the tables when the mappers are
+    # configured
+    configure_mappers()
     ORMBase.metadata.create_all(engine)
     VoidedBase.metadata.create_all(engine)
@@ -0,0 +1,186 @@
+"""
+Helpers to stream rows into tables with ``COPY ... FROM STDIN``
+"""
+from cStringIO import StringIO
+from datetime import datetime
+import json
+
+
+def _escape(value):
+    """Escape a string for the COPY text format
+
+    """
+    return value.replace('\\', '\\\\')\
+                .replace('\t', '\\t')\
+                .replace('\n', '\\n')\
+                .replace('\r', '\\r')
+
+
+def _array_literal(values):
+    """Render a list as a postgres array literal, e.g. '{"a","b"}'
+
+    """
+    elements = []
+    for value in values:
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        elements.append('"{}"'.format(value))
+    return '{' + ','.join(elements) + '}'
+
+
+def format_copy_value(value):
+    """Render a single python value as a COPY text format field
+
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, dict):
+        return _escape(json.dumps(value))
+    if isinstance(value, (list, tuple)):
+        return _escape(_array_literal(value))
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return _escape(value.encode('utf-8'))
+    return _escape(str(value))
+
+
+class CopyLoader(object):
+    """Buffers rows per table and writes them with ``COPY ... FROM
+    STDIN`` on the given connection.  Rows are written every
+    ``batch_size`` rows per table and on :func:`flush`.
+
+    .. code-block:: python
+
+        loader = CopyLoader(session.connection())
+        loader.add(table, ('node_id', '_props'), ('a', {}))
+        loader.flush()
+
+    """
+
+    def __init__(self, connection, batch_size=10000):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.count = 0
+        # Names of the tables written so far
+        self.tables = set()
+        self._buffers = {}
+
+    def add(self, table, columns, row):
+        """Buffer `row` (a tuple of values in `columns` order) for `table`
+
+        """
+        key = (table, tuple(columns))
+        buf, rows = self._buffers.get(key, (None, 0))
+        if buf is None:
+            buf = StringIO()
+        buf.write('\t'.join(format_copy_value(v) for v in row))
+        buf.write('\n')
+        self._buffers[key] = (buf, rows + 1)
+        if rows + 1 >= self.batch_size:
+            self._copy(key)
+
+    def flush(self):
+        """Write all buffered rows
+
+        """
+        for key in self._buffers.keys():
+            self._copy(key)
+
+    def _copy(self, key):
+        table, columns = key
+        buf, rows = self._buffers.pop(key)
+        buf.seek(0)
+        statement = 'COPY {} ({}) FROM STDIN'.format(
+            table.name, ', '.join(columns))
+        cursor = self.connection.connection.cursor()
+        try:
+            cursor.copy_expert(statement, buf)
+        finally:
+            cursor.close()
+        self.count += rows
+        self.tables.add(table.name)
+
+
+# Merges a VALUES list of (node_id, acl, _sysan, _props) onto a node
+# table in a single statement.  The pre-merge version of every row
+# whose properties or system annotations change is written to the
+# voided table by the same statement, and the merged properties are
+# returned for the non-null checks.
+NODE_MERGE_TEMPLATE = """
+WITH incoming (node_id, acl, _sysan, _props) AS (
+    VALUES {values}
+), existing AS (
+    SELECT node.* FROM {table} node JOIN incoming USING (node_id)
+), merged AS (
+    INSERT INTO {table} AS node (node_id, acl, _sysan, _props)
+    SELECT node_id, acl, _sysan, _props FROM incoming
+    ON CONFLICT (node_id) DO UPDATE SET
+        acl = COALESCE(NULLIF(excluded.acl, '{{}}'), node.acl),
+        _sysan = node._sysan || excluded._sysan,
+        _props = node._props || excluded._props
+    WHERE node._sysan || excluded._sysan IS DISTINCT FROM node._sysan
+       OR node._props || excluded._props IS DISTINCT FROM node._props
+       OR (excluded.acl <> '{{}}' AND excluded.acl IS DISTINCT FROM node.acl)
+    RETURNING node_id, _sysan, _props
+), voided AS (
+    INSERT INTO {voided_table}
+        (created, node_id, acl, system_annotations, properties, label)
+    SELECT existing.created, existing.node_id, existing.acl,
+           existing._sysan, existing._props, :label
+    FROM existing JOIN merged USING (node_id)
+    WHERE existing._sysan IS DISTINCT FROM merged._sysan
+       OR existing._props IS DISTINCT FROM merged._props
+)
+SELECT node_id, _props FROM merged
+"""
+
+
+def node_merge_statement(table, voided_table, rows):
+    """Build the (sql, params) for merging `rows`, a list of (node_id,
+    acl, sysan, props) tuples, onto `table`.  See NODE_MERGE_TEMPLATE.
+
+    """
+    values, params = [], {}
+    for i, (node_id, acl, sysan, props) in enumerate(rows):
+        values.append((
+            '(:node_id_{i}, CAST(:acl_{i} AS TEXT[]), '
+            'CAST(:sysan_{i} AS JSONB), CAST(:props_{i} AS JSONB))'
+        ).format(i=i))
+        params['node_id_{}'.format(i)] = node_id
+        params['acl_{}'.format(i)] = list(acl or [])
+        params['sysan_{}'.format(i)] = json.dumps(sysan)
+        params['props_{}'.format(i)] = json.dumps(props)
+    sql = NODE_MERGE_TEMPLATE.format(
+        values=',\n           '.join(values),
+        table=table.name,
+        voided_table=voided_table.name)
+    return sql, params
+
+
+# Returns the (src_id, dst_id) pairs in the given arrays whose source
+# or destination node does not exist.
+MISSING_ENDPOINTS_TEMPLATE = """
+SELECT edge.src_id, edge.dst_id
+FROM unnest(CAST(:src_ids AS TEXT[]), CAST(:dst_ids AS TEXT[]))
+     AS edge (src_id, dst_id)
+WHERE NOT EXISTS (
+    SELECT 1 FROM {src_table} WHERE node_id = edge.src_id)
+   OR NOT EXISTS (
+    SELECT 1 FROM {dst_table} WHERE node_id = edge.dst_id)
+"""
+
+
+def _referenced_table(column):
+    return list(column.foreign_keys)[0].column.table
+
+
+def missing_endpoints_statement(table):
+    """Build the sql to find edges in `table` with missing endpoints.
+    See MISSING_ENDPOINTS_TEMPLATE.
+
+    """
+    return MISSING_ENDPOINTS_TEMPLATE.format(
+        src_table=_referenced_table(table.c.src_id).name,
+        dst_table=_referenced_table(table.c.dst_id).name)
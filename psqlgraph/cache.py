@@ -0,0 +1,213 @@
+"""
+Query result cache
+
+Results of queries marked with :func:`GraphQuery.cached` are kept in a
+:class:`QueryCache`, keyed by the compiled SQL and its parameters.
+Every table has a version counter that is bumped whenever a session
+writes to the table, and a cached result is only used while the
+versions of all tables the query reads are unchanged.
+
+The results themselves are cached per process.  The version counters
+are either per process (:class:`TableVersions`) or kept in a memory
+mapped file shared by all processes on a host
+(:class:`SharedTableVersions`), in which case a write by any process
+invalidates the cached results of all of them.
+
+"""
+from collections import OrderedDict
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+_COUNTER = struct.Struct('Q')
+
+
+class TableVersions(object):
+    """Per process table version counters
+
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def bump(self, tables):
+        """Increment the version of every table name in `tables`
+
+        """
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def snapshot(self):
+        """Returns the current versions of all tables, see :func:`versions`
+
+        """
+        return dict(self._versions)
+
+    def versions(self, tables, snapshot=None):
+        """Returns a tuple of the versions of `tables` in `snapshot`, or the
+        current versions if `snapshot` is None
+
+        """
+        if snapshot is None:
+            snapshot = self._versions
+        return tuple(snapshot.get(table, 0) for table in tables)
+
+
+class SharedTableVersions(object):
+    """Table version counters in a memory mapped file, shared by every
+    process that opens the same `path`.
+
+    Table names are hashed onto a fixed number of counters, so a
+    write to one table can also invalidate results read from another
+    table that hashes onto the same counter.
+
+    .. code-block:: python
+
+        cache = QueryCache(versions=SharedTableVersions(
+            '/dev/shm/psqlgraph_table_versions'))
+
+    """
+
+    def __init__(self, path, slots=4096):
+        self.slots = slots
+        size = slots * _COUNTER.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mmap = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    def _offset(self, table):
+        return (zlib.crc32(table) & 0xffffffff) % self.slots * _COUNTER.size
+
+    def bump(self, tables):
+        """Increment the version of every table name in `tables`
+
+        """
+        offsets = set(self._offset(table) for table in tables)
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                for offset in offsets:
+                    version, = _COUNTER.unpack_from(self._mmap, offset)
+                    _COUNTER.pack_into(self._mmap, offset, version + 1)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def snapshot(self):
+        """Returns an empty snapshot of the versions, see :func:`versions`.
+        The counters of a table are only read into it the first time
+        the table is looked up in the snapshot, so starting a
+        transaction does not read the whole file.
+
+        """
+        return {}
+
+    def _version(self, offset):
+        return _COUNTER.unpack_from(self._mmap, offset)[0]
+
+    def versions(self, tables, snapshot=None):
+        """Returns a tuple of the versions of `tables` in `snapshot`, or the
+        current versions if `snapshot` is None.  Versions that are not
+        in `snapshot` yet are read and kept in it.
+
+        """
+        offsets = [self._offset(table) for table in tables]
+        if snapshot is None:
+            return tuple(self._version(offset) for offset in offsets)
+        for offset in offsets:
+            if offset not in snapshot:
+                snapshot[offset] = self._version(offset)
+        return tuple(snapshot[offset] for offset in offsets)
+
+    def close(self):
+        self._mmap.close()
+        os.close(self._fd)
+
+
+class QueryCache(object):
+    """A least recently used cache of query results
+
+    :param int max_size: The maximum number of cached results
+    :param float ttl:
+        Seconds after which a cached result is dropped even if the
+        tables it was read from have not been written
+    :param versions:
+        The table version counters, a :class:`TableVersions` by
+        default.  Pass a :class:`SharedTableVersions` to invalidate
+        results on writes by other processes.
+
+    """
+
+    def __init__(self, max_size=1000, ttl=60, versions=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.versions = TableVersions() if versions is None else versions
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, versions):
+        """Returns the result cached for `key` if it was read at table
+        `versions` and has not expired, otherwise None
+
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, entry_versions, value = entry
+            if expires < time.time():
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            if entry_versions != versions:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def set(self, key, versions, value):
+        """Cache `value` for `key`, as read at table `versions`
+
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, versions, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def tables_written(session, tables):
+    """Record that the current transaction of `session` writes to the
+    table names `tables`.  Cached results read from these tables are
+    invalidated now and again when the transaction ends, and the
+    session does not use the cache for them until then.
+
+    """
+
+    cache = getattr(session, '_query_cache', None)
+    if cache is None:
+        return
+    tables = set(tables)
+    session._query_cache_written.update(tables)
+    cache.versions.bump(tables)
@@ -4,6 +4,7 @@ from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
 
 from base import ORMBase, EDGE_TABLENAME_SCHEME, NODE_TABLENAME_SCHEME
+from registry import get_schema
 from voided_edge import VoidedEdge
 
 
@@ -170,10 +171,8 @@ class Edge(AbstractConcreteBase, ORMBase):
         """
         src_class = Node.get_subclass(src_label).__name__
         dst_class = Node.get_subclass(dst_label).__name__
-        scls = [c for c in cls.__subclasses__()
-                if c.get_label() == label
-                   and c.__src_class__ == src_class
-                   and c.__dst_class__ == dst_class]
+        scls = get_schema().edges_linking.get(
+            (src_class, label, dst_class), ())
         if len(scls) > 1:
             raise KeyError(
                 'More than one Edge with label {} found: {}'.format(
@@ -184,18 +183,31 @@ class Edge(AbstractConcreteBase, ORMBase):
 
     @classmethod
     def _get_subclasses_labeled(cls, label):
-        return [c for c in cls.__subclasses__()
-                if c.get_label() == label]
+        return list(get_schema().edges_labeled.get(label, ()))
+
+    @classmethod
+    def _get_subclasses_of_types(cls, edge_types=None):
+        """Returns the subclasses for a list of edge labels or classes,
+        or all subclasses if `edge_types` is None.
+
+        """
+        if edge_types is None:
+            return cls.get_subclasses()
+        classes = []
+        for edge_type in edge_types:
+            if isinstance(edge_type, basestring):
+                classes += cls._get_subclasses_labeled(edge_type)
+            else:
+                classes.append(edge_type)
+        return classes
 
     @classmethod
     def _get_edges_with_src(cls, src_class_name):
-        return [c for c in cls.__subclasses__()
-                if c.__src_class__ == src_class_name]
+        return list(get_schema().edges_with_src.get(src_class_name, ()))
 
     @classmethod
     def _get_edges_with_dst(cls, dst_class_name):
-        return [c for c in cls.__subclasses__()
-                if c.__dst_class__ == dst_class_name]
+        return list(get_schema().edges_with_dst.get(dst_class_name, ()))
 
     @classmethod
     def get_subclass_table_names(label):
@@ -205,11 +217,13 @@ class Edge(AbstractConcreteBase, ORMBase):
     def get_subclasses(cls):
         return [s for s in cls.__subclasses__()]
 
-    def _snapshot_existing(self, session, old_props, old_sysan):
+    def _snapshot(self, old_props, old_sysan):
         temp = self.__class__(self.src_id, self.dst_id, old_props, self.acl,
                               old_sysan, self.label)
-        voided = VoidedEdge(temp)
-        session.add(voided)
+        return VoidedEdge(temp)
+
+    def _snapshot_existing(self, session, old_props, old_sysan):
+        session.add(self._snapshot(old_props, old_sysan))
 
     # ======== Label ========
     @hybrid_property
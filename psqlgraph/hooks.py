@@ -1,7 +1,10 @@
 """
 Session hooks
 """
+from collections import OrderedDict
 from sqlalchemy.inspection import inspect
+from cache import tables_written
+from registry import get_schema
 from node import Node
 from edge import Edge
 
@@ -41,8 +44,54 @@ def is_psqlgraph_entity(target):
     """Only attempt to track history on Nodes and Edges
 
     """
-    return target.__class__ in (
-        Node.__subclasses__()+Edge.__subclasses__())
+    return target.__class__ in get_schema().entity_classes
+
+
+def transaction_timestamp(session):
+    """Returns the server time of the session's transaction.  This is
+    constant for a transaction, so it is only queried on the first
+    flush of every transaction.
+
+    """
+
+    transaction = session.transaction
+    while transaction._parent is not None:
+        transaction = transaction._parent
+    if session._flush_timestamp_transaction is not transaction:
+        session._flush_timestamp = list(
+            session.execute("SELECT CURRENT_TIMESTAMP"))[0][0]
+        session._flush_timestamp_transaction = transaction
+    return session._flush_timestamp
+
+
+def snapshot(session, target, props, sysan, snapshots=None):
+    """Snapshot `target` with the given old props and sysan.
+
+    If `snapshots` is None, the voided entity is added to the session.
+    Otherwise it is appended to `snapshots` as a row to be written by
+    :func:`insert_snapshots`.
+
+    """
+
+    if snapshots is None:
+        return target._snapshot_existing(session, props, sysan)
+    voided = target._snapshot(props, sysan)
+    mapper = inspect(voided).mapper
+    row = {attr.key: getattr(voided, attr.key)
+           for attr in mapper.column_attrs
+           if getattr(voided, attr.key) is not None}
+    key = (mapper.local_table, tuple(sorted(row)))
+    snapshots.setdefault(key, []).append(row)
+
+
+def insert_snapshots(session, snapshots):
+    """Write the rows collected by :func:`snapshot` with one multi-row
+    INSERT per voided table.
+
+    """
+
+    for (table, _), rows in snapshots.items():
+        session.execute(table.insert(inline=True).values(rows))
 
 
 def receive_before_flush(session, flush_context, instances):
@@ -62,11 +111,16 @@ def receive_before_flush(session, flush_context, instances):
     - Start with unchanged props/sysan
     - Merge deleted props/sysan on top of that
 
+    If ``session._batch_snapshots`` is set, the snapshots are written
+    with one INSERT per voided table instead of being added to the
+    session as voided entities.
+
     """
 
     if session._set_flush_timestamps:
-        session._flush_timestamp = list(
-            session.execute("SELECT CURRENT_TIMESTAMP"))[0][0]
+        transaction_timestamp(session)
+
+    snapshots = OrderedDict() if session._batch_snapshots else None
 
     for target in session.dirty:
         if not is_psqlgraph_entity(target):
@@ -76,7 +130,7 @@ def receive_before_flush(session, flush_context, instances):
         props, sysan = get_old_version(target, 'unchanged', 'deleted')
         props_diff, sysan_diff = get_old_version(target, 'deleted', 'added')
         if props_diff or sysan_diff:
-            target._snapshot_existing(session, props, sysan)
+            snapshot(session, target, props, sysan, snapshots)
         target._merge_onto_existing(props, sysan)
 
         # Call custom session hook
@@ -88,7 +142,7 @@ def receive_before_flush(session, flush_context, instances):
             continue
 
         props, sysan = get_old_version(target, 'unchanged', 'deleted', 'added')
-        target._snapshot_existing(session, props, sysan)
+        snapshot(session, target, props, sysan, snapshots)
 
         # Call custom session hook
         for f in target._session_hooks_before_delete:
@@ -104,3 +158,52 @@ def receive_before_flush(session, flush_context, instances):
         # Call custom session hook
         for f in target._session_hooks_before_insert:
             f(target, session, flush_context, instances)
+
+    # Recorded last so that the voided tables of the snapshots and
+    # anything added by the custom session hooks are included
+    if session._query_cache is not None:
+        tables = set(
+            inspect(target).mapper.local_table.name
+            for target in session.dirty | session.deleted | session.new)
+        tables.update(table.name for table, _ in snapshots or {})
+        tables_written(session, tables)
+
+    if snapshots:
+        insert_snapshots(session, snapshots)
+
+
+def receive_after_begin_query_cache(session, transaction, connection):
+    """Provide a session hook that starts a snapshot of the table versions
+    for a transaction, so that cached results are only used if they
+    were read at the versions the transaction first saw.
+
+    """
+
+    if session._query_cache is not None \
+       and session._query_cache_versions is None:
+        session._query_cache_versions = \
+            session._query_cache.versions.snapshot()
+
+
+def receive_after_transaction_end(session, transaction):
+    """Provide a session hook that invalidates cached results read from
+    the tables written by a transaction once it has been committed or
+    rolled back.
+
+    """
+
+    if session._query_cache is None or transaction._parent is not None:
+        return
+    if session._query_cache_written:
+        session._query_cache.versions.bump(session._query_cache_written)
+    session._query_cache_written = set()
+    session._query_cache_versions = None
+
+
+def receive_after_begin_read_only(session, transaction, connection):
+    """Provide a session hook that marks every transaction of a read-only
+    session as ``READ ONLY``.
+
+    """
+
+    connection.execute('SET TRANSACTION READ ONLY')
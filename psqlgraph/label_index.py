@@ -0,0 +1,87 @@
+"""
+Optional node_id -> label index
+
+A narrow table holding the label of every node, kept up to date by
+triggers on the node tables.  When a driver is created with
+``node_label_index=True``, lookups by node_id on a polymorphic
+``Node`` query use it to query only the one node table holding the
+row instead of the union over every node table.
+
+"""
+from sqlalchemy import Column, Text, MetaData, Table, select
+from node import Node
+
+
+metadata = MetaData()
+
+node_label_index = Table(
+    '_node_label_index', metadata,
+    Column('node_id', Text, primary_key=True, nullable=False),
+    Column('label', Text, primary_key=True, nullable=False),
+)
+
+SYNC_FUNCTION = """
+CREATE OR REPLACE FUNCTION _node_label_index_sync() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM _node_label_index WHERE label = TG_ARGV[0];
+    ELSIF TG_OP = 'INSERT' THEN
+        INSERT INTO _node_label_index (node_id, label)
+        VALUES (NEW.node_id, TG_ARGV[0]);
+    ELSIF TG_OP = 'DELETE' THEN
+        DELETE FROM _node_label_index
+        WHERE node_id = OLD.node_id AND label = TG_ARGV[0];
+    ELSIF NEW.node_id <> OLD.node_id THEN
+        UPDATE _node_label_index SET node_id = NEW.node_id
+        WHERE node_id = OLD.node_id AND label = TG_ARGV[0];
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+TRIGGERS = """
+DROP TRIGGER IF EXISTS {table}_label_index ON {table};
+DROP TRIGGER IF EXISTS {table}_label_index_truncate ON {table};
+CREATE TRIGGER {table}_label_index
+    AFTER INSERT OR UPDATE OF node_id OR DELETE ON {table}
+    FOR EACH ROW EXECUTE PROCEDURE _node_label_index_sync('{label}');
+CREATE TRIGGER {table}_label_index_truncate
+    AFTER TRUNCATE ON {table}
+    FOR EACH STATEMENT EXECUTE PROCEDURE _node_label_index_sync('{label}');
+"""
+
+BACKFILL = """
+DELETE FROM _node_label_index WHERE label = '{label}';
+INSERT INTO _node_label_index (node_id, label)
+    SELECT node_id, '{label}' FROM {table};
+"""
+
+
+def create_node_label_index(engine):
+    """Create the node label index table and the triggers that maintain
+    it on every node table, and (re)build its contents from the node
+    tables.
+
+    This is idempotent and should be re-run whenever node classes are
+    added to the model.
+
+    """
+
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(SYNC_FUNCTION)
+        for cls in Node.get_subclasses():
+            params = dict(table=cls.__tablename__, label=cls.get_label())
+            conn.execute(TRIGGERS.format(**params))
+            conn.execute(BACKFILL.format(**params))
+
+
+def get_node_labels(session, ids):
+    """Returns the set of labels of the nodes with node_id in `ids`
+
+    """
+    return {label for label, in session.execute(
+        select([node_label_index.c.label])
+        .where(node_label_index.c.node_id.in_(ids))
+        .distinct())}
@@ -1,5 +1,6 @@
 from base import ORMBase, NODE_TABLENAME_SCHEME
 from edge import Edge
+from registry import get_schema
 from sqlalchemy import Column, Text, UniqueConstraint, Index
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.declarative import AbstractConcreteBase, declared_attr
@@ -169,17 +170,22 @@ class Node(AbstractConcreteBase, ORMBase):
                    
     @classmethod
     def get_subclass(cls, label):
-        for c in cls.__subclasses__():
-            if c.get_label() == label:
-                return c
-        return None
+        if cls is Node:
+            classes = get_schema().nodes_labeled.get(label, ())
+        else:
+            classes = [c for c in cls.__subclasses__()
+                       if c.get_label() == label]
+        return classes[0] if classes else None
 
     @classmethod
     def get_subclass_named(cls, name):
-        for c in cls.__subclasses__():
-            if c.__name__ == name:
-                return c
-        raise KeyError('Node has no subclass named {}'.format(name))
+        if cls is Node:
+            scls = get_schema().nodes_named.get(name)
+        else:
+            scls = {c.__name__: c for c in cls.__subclasses__()}.get(name)
+        if scls is None:
+            raise KeyError('Node has no subclass named {}'.format(name))
+        return scls
 
     @classmethod
     def get_subclass_table_names(label):
@@ -205,11 +211,13 @@ class Node(AbstractConcreteBase, ORMBase):
                       .filter(VoidedNode.label == self.label)\
                       .order_by(VoidedNode.voided.desc())
 
-    def _snapshot_existing(self, session, old_props, old_sysan):
+    def _snapshot(self, old_props, old_sysan):
         temp = TmpNode(self.node_id, old_props, self.acl,
                               old_sysan, self.label, self.created)
-        voided = VoidedNode(temp)
-        session.add(voided)
+        return VoidedNode(temp)
+
+    def _snapshot_existing(self, session, old_props, old_sysan):
+        session.add(self._snapshot(old_props, old_sysan))
 
 
 class TmpNode(object):
@@ -0,0 +1,100 @@
+"""
+Connection pool with checkout statistics
+"""
+from sqlalchemy.log import InstanceLogger
+from sqlalchemy.pool import QueuePool
+import logging
+import threading
+import time
+import weakref
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that records how many connections were checked out,
+    how long callers waited for them, and when every pooled
+    connection was opened.  See :func:`stats`.
+
+    """
+
+    def __init__(self, creator, **kwargs):
+        super(InstrumentedQueuePool, self).__init__(creator, **kwargs)
+        self._set_logger()
+        self._stats_lock = threading.Lock()
+        self._checkout_depth = threading.local()
+        self._records = weakref.WeakSet()
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _set_logger(self):
+        # Log under the sqlalchemy.pool logger like QueuePool does, so
+        # that the sqlalchemy logging configuration applies
+        name = 'sqlalchemy.pool.QueuePool'
+        if self.logging_name:
+            name = '{}.{}'.format(name, self.logging_name)
+        if self._echo in (False, None):
+            self.logger = logging.getLogger(name)
+        else:
+            self.logger = InstanceLogger(self._echo, name)
+
+    def _create_connection(self):
+        record = super(InstrumentedQueuePool, self)._create_connection()
+        self._records.add(record)
+        return record
+
+    def _do_get(self):
+        # QueuePool._do_get can retry by calling itself, only the
+        # outermost call is a checkout
+        depth = getattr(self._checkout_depth, 'value', 0)
+        self._checkout_depth.value = depth + 1
+        start = time.time()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        finally:
+            self._checkout_depth.value = depth
+            if not depth:
+                self._record_wait(time.time() - start)
+
+    def _record_wait(self, wait):
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_time += wait
+            self.max_wait_time = max(self.max_wait_time, wait)
+
+    def connection_ages(self):
+        """Returns the age in seconds of every open pooled connection,
+        oldest first
+
+        """
+        now = time.time()
+        return sorted((now - record.starttime for record in list(self._records)
+                       if record.connection is not None), reverse=True)
+
+    def stats(self):
+        """Returns a dict of pool statistics:
+
+        - ``size``: the configured number of pooled connections
+        - ``checked_out``: connections currently in use
+        - ``idle``: connections waiting in the pool
+        - ``overflow``: connections open beyond ``size``, negative
+          while the pool has not been filled yet
+        - ``checkouts``: total number of checkouts
+        - ``wait_time``: total seconds spent waiting for checkouts
+        - ``max_wait_time``: longest single wait for a checkout
+        - ``connection_ages``: see :func:`connection_ages`
+
+        """
+        with self._stats_lock:
+            checkouts = self.checkouts
+            wait_time = self.wait_time
+            max_wait_time = self.max_wait_time
+        return dict(
+            size=self.size(),
+            checked_out=self.checkedout(),
+            idle=self.checkedin(),
+            overflow=self.overflow(),
+            checkouts=checkouts,
+            wait_time=wait_time,
+            max_wait_time=max_wait_time,
+            connection_ages=self.connection_ages(),
+        )
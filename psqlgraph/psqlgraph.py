@@ -2,17 +2,31 @@
 #
 
 # External modules
+from collections import OrderedDict
 from contextlib import contextmanager
-from sqlalchemy import create_engine, event
+from sqlalchemy import create_engine, event, text, inspect, bindparam
+from sqlalchemy import select, union_all, literal, cast, Text
+from sqlalchemy.dialects.postgresql import ARRAY, Any
 from sqlalchemy.orm import sessionmaker, configure_mappers
+from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from xlocal import xlocal
+import itertools
 import logging
 # Custom modules
+from bulk import CopyLoader
+from bulk import node_merge_statement, missing_endpoints_statement
+from cache import QueryCache, tables_written
 from edge import Edge, PolyEdge
-from exc import QueryError
-from hooks import receive_before_flush
+from exc import QueryError, EdgeCreationError
+from hooks import receive_before_flush, receive_after_begin_read_only
+from hooks import receive_after_begin_query_cache
+from hooks import receive_after_transaction_end
 from node import PolyNode, Node
+from pool import InstrumentedQueuePool
 from query import GraphQuery
+from records import NodeRecord, EdgeRecord
+from registry import get_schema
+from statements import StatementCache
 from util import pg_property
 from util import retryable, default_backoff
 from voided_edge import VoidedEdge
@@ -27,6 +41,7 @@ DEFAULT_RETRIES = 0
 class PsqlGraphDriver(object):
 
     acceptable_isolation_levels = ['REPEATABLE_READ', 'SERIALIZABLE']
+    read_replica_strategies = ['round_robin', 'least_connections']
 
     def __init__(self, host, user, password, database, **kwargs):
         """Create a Postgresql Graph Driver
@@ -34,7 +49,61 @@ class PsqlGraphDriver(object):
         :param bool set_flush_timestamps:
             Is `True` by default.  Setting this to `True` will
             perform an extra database query to get the server time at
-            flush and store `session._flush_timestamp`.
+            flush and store `session._flush_timestamp`.  The server
+            time is only queried on the first flush of a transaction.
+        :param bool batch_snapshots:
+            Is `False` by default.  Setting this to `True` will write
+            the voided snapshots of all nodes and edges changed in a
+            flush with one multi-row INSERT per voided table, instead
+            of adding a voided entity per change to the session.
+        :param bool node_label_index:
+            Is `False` by default.  Setting this to `True` will route
+            lookups by node_id on polymorphic ``Node`` queries to a
+            single node table using the node label index, which must
+            have been created with :func:`create_node_label_index`.
+        :param list read_replicas:
+            Optional list of read replicas used by
+            ``session_scope(read_only=True)``.  Each replica is either
+            a host name or a dict that overrides any of ``host``,
+            ``user``, ``password`` and ``database``.
+        :param str read_replica_strategy:
+            How a replica is chosen for a read-only session, either
+            ``'round_robin'`` (default) or ``'least_connections'``.
+        :param int pool_size:
+            The number of connections kept open by the pool, 5 by
+            default.
+        :param int max_overflow:
+            The number of connections that can be opened beyond
+            ``pool_size`` when the pool is exhausted, 10 by default.
+        :param int pool_timeout:
+            Seconds to wait for a connection before giving up, 30 by
+            default.
+        :param int pool_recycle:
+            Seconds after which a connection is reopened on checkout,
+            never by default.
+
+        The pool sizing options apply to the primary engine and to
+        every read replica engine.  See :func:`pool_stats`.
+
+        :param bool statement_cache:
+            Is `True` by default.  Point lookups by node_id, or by
+            src_id and dst_id, through :func:`node_lookup_one`,
+            :func:`edge_lookup_one` and :func:`reload` reuse SQL
+            compiled once per entity class, see
+            :class:`StatementCache`.
+        :param bool prepared_statements:
+            Is `False` by default.  Setting this to `True` will also
+            ``PREPARE`` the cached statements once per connection so
+            that postgres does not plan them on every lookup.  Leave
+            this off behind a transaction pooling proxy such as
+            pgbouncer, where prepared statements do not follow the
+            session.
+        :param query_cache:
+            Is `None` by default.  Either `True` or a
+            :class:`QueryCache` enables caching the results of
+            queries marked with :func:`GraphQuery.cached`.  Cached
+            results are invalidated when a session writes to any of
+            the tables they were read from.
 
         """
 
@@ -43,17 +112,38 @@ class PsqlGraphDriver(object):
         kwargs.pop('node_validator', None)
         kwargs.pop('edge_validator', None)
         self.set_flush_timestamps = kwargs.pop('set_flush_timestamps', True)
+        self.batch_snapshots = kwargs.pop('batch_snapshots', False)
+        self.node_label_index = kwargs.pop('node_label_index', False)
+        if kwargs.pop('statement_cache', True):
+            self.statement_cache = StatementCache(
+                prepared=kwargs.pop('prepared_statements', False))
+        else:
+            kwargs.pop('prepared_statements', None)
+            self.statement_cache = None
+        self.query_cache = kwargs.pop('query_cache', None)
+        if self.query_cache is True:
+            self.query_cache = QueryCache()
+        read_replicas = kwargs.pop('read_replicas', [])
+        self.read_replica_strategy = kwargs.pop(
+            'read_replica_strategy', 'round_robin')
+        if self.read_replica_strategy not in self.read_replica_strategies:
+            raise ValueError('Unknown read replica strategy {}'.format(
+                self.read_replica_strategy))
         if 'isolation_level' not in kwargs:
             kwargs['isolation_level'] = 'REPEATABLE_READ'
+        kwargs.setdefault('poolclass', InstrumentedQueuePool)
         if 'application_name' in kwargs:
             connect_args['application_name'] = kwargs.pop('application_name')
         else:
             connect_args['application_name'] = socket.gethostname()
 
         # Construct connection string
-        host = '' if host is None else host
-        conn_str = 'postgresql://{user}:{password}@{host}/{database}'.format(
-            user=user, password=password, host=host, database=database)
+        def connection_string(host, user, password, database):
+            host = '' if host is None else host
+            return 'postgresql://{user}:{password}@{host}/{database}'.format(
+                user=user, password=password, host=host, database=database)
+
+        conn_str = connection_string(host, user, password, database)
         if kwargs['isolation_level'] not in self.acceptable_isolation_levels:
             logging.warn((
                 "Using an isolation level '{}' that is not in the list of "
@@ -71,18 +161,86 @@ class PsqlGraphDriver(object):
             **kwargs
         )
 
+        # Create read replica engines
+        self.read_engines = []
+        for replica in read_replicas:
+            if not isinstance(replica, dict):
+                replica = {'host': replica}
+            params = dict(
+                host=host, user=user, password=password, database=database)
+            params.update(replica)
+            self.read_engines.append(create_engine(
+                connection_string(**params),
+                encoding='latin1',
+                connect_args=connect_args,
+                **kwargs
+            ))
+        self._read_engine_counter = itertools.count()
+
+        # Create session factories
+        self._session_factory = sessionmaker(
+            bind=self.engine, expire_on_commit=False,
+            class_=GraphSession, query_cls=GraphQuery)
+        event.listen(
+            self._session_factory, 'before_flush', receive_before_flush)
+        self._read_session_factory = sessionmaker(
+            expire_on_commit=False, class_=GraphSession,
+            query_cls=GraphQuery)
+        event.listen(
+            self._read_session_factory, 'after_begin',
+            receive_after_begin_read_only)
+        for factory in (self._session_factory, self._read_session_factory):
+            event.listen(
+                factory, 'after_begin', receive_after_begin_query_cache)
+            event.listen(
+                factory, 'after_transaction_end',
+                receive_after_transaction_end)
+
         # Create context for xlocal sessions
         self.context = xlocal()
 
-    def _new_session(self):
-        Session = sessionmaker(expire_on_commit=False, class_=GraphSession)
-        Session.configure(bind=self.engine, query_cls=GraphQuery)
-        session = Session()
+    def _new_session(self, read_only=False):
+        if read_only:
+            session = self._read_session_factory(bind=self._read_engine())
+            session._set_flush_timestamps = False
+        else:
+            session = self._session_factory()
+            session._set_flush_timestamps = self.set_flush_timestamps
+        session._batch_snapshots = self.batch_snapshots
         session._flush_timestamp = None
-        session._set_flush_timestamps = self.set_flush_timestamps
-        event.listen(session, 'before_flush', receive_before_flush)
+        session._flush_timestamp_transaction = None
+        session._node_label_index = self.node_label_index
+        session._query_cache = self.query_cache
+        session._query_cache_versions = None
+        session._query_cache_written = set()
         return session
 
+    def _read_engine(self):
+        """Choose the engine for a read-only session from the read
+        replicas, or the primary engine if there are none.
+
+        """
+        if not self.read_engines:
+            return self.engine
+        if self.read_replica_strategy == 'least_connections':
+            return min(self.read_engines,
+                       key=lambda engine: engine.pool.checkedout())
+        i = next(self._read_engine_counter)
+        return self.read_engines[i % len(self.read_engines)]
+
+    def pool_stats(self, engine=None):
+        """Returns connection pool statistics for `engine`, by default
+        the primary engine.  Pass one of ``driver.read_engines`` for
+        a read replica.  See :func:`InstrumentedQueuePool.stats`.
+
+        """
+        engine = self.engine if engine is None else engine
+        if not isinstance(engine.pool, InstrumentedQueuePool):
+            raise ValueError(
+                'Pool statistics require an InstrumentedQueuePool, '
+                'not {}'.format(type(engine.pool).__name__))
+        return engine.pool.stats()
+
     def has_session(self):
         return hasattr(self.context, "session")
 
@@ -91,7 +249,7 @@ class PsqlGraphDriver(object):
 
     @contextmanager
     def session_scope(self, session=None, can_inherit=True,
-                      must_inherit=False):
+                      must_inherit=False, read_only=False):
         """Provide a transactional scope around a series of operations.
 
         This session scope has a deceptively complex behavior, so be
@@ -161,6 +319,12 @@ class PsqlGraphDriver(object):
             scope must inherit a session from a parent session.  This
             parameter can be set to true to prevent session leaks from
             functions which return raw query objects
+        :param bool read_only:
+            If a new session is created, bind it to one of the
+            driver's read replicas (or the primary if there are none)
+            and run its transactions as ``READ ONLY``.  Read-only
+            sessions do not run the flush hooks.  This has no effect
+            on an inherited session.
 
         """
 
@@ -176,7 +340,7 @@ class PsqlGraphDriver(object):
             local = session
         elif not (can_inherit and self.has_session()):
             inherited_session = False
-            local = self._new_session()
+            local = self._new_session(read_only)
         else:
             local = self.current_session()
 
@@ -255,6 +419,59 @@ class PsqlGraphDriver(object):
     def get_edges(self, session=None, batch_size=1000):
         return self.edges().yield_per(batch_size)
 
+    def stream(self, query, batch_size=1000):
+        """Stream the results of a node or edge query as lightweight
+        read-only records using a server-side cursor.
+
+        Only the ids, label, acl, properties, system annotations and
+        creation time are selected.  No ORM instances are built and
+        nothing is added to the session, so memory use is bounded by
+        ``batch_size`` regardless of the size of the result.  The
+        returned generator must be consumed inside the session scope.
+
+        .. code-block:: python
+
+            with g.session_scope():
+                for record in g.stream(g.nodes(Test).props(key='value')):
+                    print record.node_id, record.props
+
+        :param query: A node or edge GraphQuery
+        :param int batch_size: The number of rows fetched per round trip
+        :returns: A generator of :class:`NodeRecord` or :class:`EdgeRecord`
+
+        """
+
+        entity = query.entity()
+        if issubclass(inspect(entity).mapper.class_, Edge):
+            Record = EdgeRecord
+            ids = [entity.src_id, entity.dst_id]
+        else:
+            Record = NodeRecord
+            ids = [entity.node_id]
+
+        statement = query.with_entities(*ids + [
+            query._label_column(),
+            entity.acl,
+            entity._props,
+            entity._sysan,
+            entity.created,
+        ]).statement
+
+        if query._autoflush:
+            query.session._autoflush()
+        result = query.session.connection()\
+                              .execution_options(stream_results=True)\
+                              .execute(statement)
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield Record(*row)
+        finally:
+            result.close()
+
     def get_node_count(self, session=None):
         return self.nodes().count()
 
@@ -266,12 +483,8 @@ class PsqlGraphDriver(object):
                    session=None, max_retries=DEFAULT_RETRIES,
                    backoff=default_backoff):
         with self.session_scope() as local:
-            if not node and not label:
-                node = self.nodes().ids(node_id).scalar()
-
-            elif not node and label:
-                cls = Node.get_subclass(label)
-                node = self.nodes(cls).ids(node_id).scalar()
+            if not node:
+                node = self.node_lookup_one(node_id=node_id, label=label)
 
             if not node:
                 node = PolyNode(
@@ -284,10 +497,112 @@ class PsqlGraphDriver(object):
 
         return node
 
+    def node_merge_many(self, nodes, batch_size=1000, session=None):
+        """Merge many nodes with one ``INSERT ... ON CONFLICT`` statement
+        per concrete ``node_*`` table (and per ``batch_size`` nodes).
+
+        Properties and system annotations are merged onto existing
+        rows as with :func:`node_merge`.  The acl of an existing row
+        is replaced only if the given node has a non-empty acl.  The
+        previous version of each row whose properties or system
+        annotations change is written to ``_voided_nodes`` by the same
+        statement; rows that would not change are not written at all.
+
+        .. note::
+            This requires Postgres 9.5+.  The nodes are not added to
+            the session, no session hooks are called, and instances
+            already loaded in the session are not refreshed.
+
+        :param nodes: An iterable of Node subclass instances
+        :param int batch_size:
+            The maximum number of nodes merged per statement
+        :returns: The number of nodes inserted or changed
+
+        """
+
+        pending, written = {}, 0
+        with self.session_scope(session) as local:
+            for node in nodes:
+                node._validate_properties()
+                rows = pending.setdefault(type(node), OrderedDict())
+                if node.node_id in rows:
+                    # A node_id can only be upserted once per statement
+                    _, acl, sysan, props = rows[node.node_id]
+                    acl = node.acl or acl
+                    sysan = dict(sysan, **node._sysan)
+                    props = dict(props, **node._props)
+                else:
+                    acl, sysan, props = node.acl, node._sysan, node._props
+                rows[node.node_id] = (node.node_id, acl, sysan, props)
+                if len(rows) >= batch_size:
+                    written += self._merge_node_rows(
+                        local, type(node), pending.pop(type(node)).values())
+            for cls, rows in pending.iteritems():
+                written += self._merge_node_rows(local, cls, rows.values())
+
+        return written
+
+    def _merge_node_rows(self, session, cls, rows):
+        """Merge (node_id, acl, sysan, props) `rows` onto the table for
+        `cls` and check the merged rows' non-null properties.
+
+        """
+        sql, params = node_merge_statement(
+            cls.__table__, VoidedNode.__table__, rows)
+        params['label'] = cls.get_label()
+        tables_written(
+            session, [cls.__tablename__, VoidedNode.__tablename__])
+        merged = session.execute(text(sql), params).fetchall()
+        for node_id, props in merged:
+            for key in getattr(cls, '__nonnull_properties__', []):
+                assert props.get(key) is not None, (
+                    "Null value in key '{}' violates non-null constraint "
+                    "for {}."
+                ).format(key, cls(node_id))
+        return len(merged)
+
     def node_insert(self, node, session=None):
         with self.session_scope() as local:
             local.add(node)
 
+    def bulk_insert_nodes(self, nodes, batch_size=10000, session=None):
+        """Insert nodes using ``COPY ... FROM STDIN``, one stream per
+        concrete ``node_*`` table.
+
+        Each node is checked against its pg_property types and enums
+        and its ``__nonnull_properties__`` before it is written.  The
+        nodes are not added to the session, so there is no flush, no
+        ``_session_hooks_before_insert`` are called and the instances
+        remain transient afterwards.
+
+        :param nodes: An iterable of Node subclass instances
+        :param int batch_size:
+            The number of rows buffered per table before they are
+            sent to the database
+        :returns: The number of nodes inserted
+
+        """
+
+        columns = ('node_id', 'acl', '_sysan', '_props', 'created')
+        with self.session_scope(session) as local:
+            now = None
+            loader = CopyLoader(local.connection(), batch_size)
+            for node in nodes:
+                node._validate_properties()
+                node._validate()
+                created = node.created
+                if created is None:
+                    if now is None:
+                        now = local.execute(
+                            'SELECT CURRENT_TIMESTAMP').scalar()
+                    created = now
+                loader.add(node.__table__, columns, (
+                    node.node_id, node.acl, node._sysan, node._props,
+                    created))
+            loader.flush()
+            tables_written(local, loader.tables)
+        return loader.count
+
     def node_update(self, node, system_annotations={},
                     acl=None, properties={}, session=None):
         with self.session_scope() as local:
@@ -319,12 +634,25 @@ class PsqlGraphDriver(object):
             query = query.sysan(system_annotation_matches)
         return query
 
-    def node_lookup_one(self, *args, **kwargs):
-        return self.node_lookup(*args, **kwargs).scalar()
+    def node_lookup_one(self, node_id=None, property_matches=None,
+                        label=None, system_annotation_matches=None,
+                        voided=False, session=None):
+        cls = Node.get_subclass(label) if label else Node
+        routed = cls is Node and self.node_label_index
+        if isinstance(node_id, basestring) and property_matches is None \
+           and system_annotation_matches is None \
+           and not voided and not routed:
+            return self._lookup_one(cls, node_id=node_id)
+        return self.node_lookup(
+            node_id, property_matches, label, system_annotation_matches,
+            voided, session).scalar()
 
     def node_lookup_by_id(self, node_id, voided=False, session=None):
-        return self.node_lookup(
+        query = self.node_lookup(
             node_id=node_id, voided=voided, session=session)
+        if isinstance(node_id, basestring) and not voided:
+            query = self._cached_query(query, node_id=node_id)
+        return query
 
     def node_lookup_by_matches(self, property_matches=None,
                                system_annotation_matches=None,
@@ -395,6 +723,73 @@ class PsqlGraphDriver(object):
             local.flush()
         return edge
 
+    def bulk_insert_edges(self, edges, batch_size=10000, session=None):
+        """Insert edges using ``COPY ... FROM STDIN``, one stream per
+        concrete ``edge_*`` table.
+
+        The session is flushed once up front so that pending nodes are
+        visible.  Each edge is checked against its pg_property types
+        and enums and its ``__nonnull_properties__``, and the
+        existence of the edges' endpoints is checked with one query
+        per edge table and batch.  The edges are not added to the
+        session.
+
+        :param edges: An iterable of Edge subclass instances
+        :param int batch_size:
+            The number of edges checked and buffered per table before
+            they are sent to the database
+        :returns: The number of edges inserted
+
+        """
+
+        with self.session_scope(session) as local:
+            local.flush()
+            now = local.execute('SELECT CURRENT_TIMESTAMP').scalar()
+            loader = CopyLoader(local.connection(), batch_size)
+            pending = {}
+            for edge in edges:
+                edge._validate_properties()
+                edge._validate()
+                batch = pending.setdefault(type(edge), [])
+                batch.append(edge)
+                if len(batch) >= batch_size:
+                    self._copy_edges(
+                        local, loader, pending.pop(type(edge)), now)
+            for batch in pending.values():
+                self._copy_edges(local, loader, batch, now)
+            loader.flush()
+            tables_written(local, loader.tables)
+        return loader.count
+
+    def _copy_edges(self, session, loader, edges, created):
+        """Check the endpoints of `edges` (all of the same type) and
+        hand them to the CopyLoader `loader`.
+
+        """
+        columns = ('src_id', 'dst_id', 'acl', '_sysan', '_props', 'created')
+        self._check_edge_endpoints(session, type(edges[0]), edges)
+        for edge in edges:
+            loader.add(edge.__table__, columns, (
+                edge.src_id, edge.dst_id, edge.acl, edge._sysan,
+                edge._props, edge.created or created))
+
+    def _check_edge_endpoints(self, session, cls, edges):
+        """Raise an EdgeCreationError if the src or dst node of any of
+        `edges` (all of type `cls`) does not exist.
+
+        """
+        missing = session.execute(
+            text(missing_endpoints_statement(cls.__table__)), {
+                'src_ids': [edge.src_id for edge in edges],
+                'dst_ids': [edge.dst_id for edge in edges],
+            }).fetchall()
+        if missing:
+            raise EdgeCreationError((
+                '{} {} edges reference nodes that do not exist, e.g. '
+                '({})-[{}]->({})'
+            ).format(len(missing), cls.__name__, missing[0][0],
+                     cls.get_label(), missing[0][1]))
+
     def edge_update(self, edge, system_annotations={}, properties={},
                     session=None):
         with self.session_scope(session) as local:
@@ -406,6 +801,12 @@ class PsqlGraphDriver(object):
 
     def edge_lookup_one(self, src_id=None, dst_id=None, label=None,
                         voided=False, session=None):
+        classes = Edge._get_subclasses_labeled(label) if label else [Edge]
+        ids = {key: value for key, value in [
+            ('src_id', src_id), ('dst_id', dst_id)] if value is not None}
+        if ids and len(classes) == 1 and not voided and all(
+                isinstance(value, basestring) for value in ids.values()):
+            return self._lookup_one(classes[0], **ids)
         return self.edge_lookup(src_id, dst_id, label, voided, session)\
                    .scalar()
 
@@ -424,8 +825,12 @@ class PsqlGraphDriver(object):
             queries = [q.dst(dst_id) for q in queries]
         if len(queries) > 1:
             return queries[0].union_all(*queries[1:])
-        else:
-            return queries[0]
+        ids = {key: value for key, value in [
+            ('src_id', src_id), ('dst_id', dst_id)] if value is not None}
+        if ids and not voided and all(
+                isinstance(value, basestring) for value in ids.values()):
+            return self._cached_query(queries[0], **ids)
+        return queries[0]
 
     def edge_lookup_voided(self, src_id=None, dst_id=None, label=None,
                            session=None):
@@ -446,19 +851,167 @@ class PsqlGraphDriver(object):
             for edge in self.edges().filter(Edge.dst_id == node_id):
                 local.delete(edge)
 
+    def _adjacent(self, session, ids, direction, edge_classes):
+        """Returns (edge class name, node_id, neighbor_id, outbound) for
+        the edges from (``direction='out'``), to (``direction='in'``)
+        or from and to (``direction='both'``) the nodes with node_id in
+        `ids`, with one query over all `edge_classes`.
+
+        """
+        if not ids or not edge_classes:
+            return []
+        ids = cast(bindparam('ids', list(ids), type_=ARRAY(Text)),
+                   ARRAY(Text))
+        selects = []
+        for cls in edge_classes:
+            table = cls.__table__
+            sides = []
+            if direction in ('out', 'both'):
+                sides.append((table.c.src_id, table.c.dst_id, True))
+            if direction in ('in', 'both'):
+                sides.append((table.c.dst_id, table.c.src_id, False))
+            for this_id, next_id, outbound in sides:
+                selects.append(select([
+                    literal(cls.__name__).label('edge_class'),
+                    this_id.label('node_id'),
+                    next_id.label('neighbor_id'),
+                    literal(outbound).label('outbound'),
+                ]).where(Any(this_id, ids)))
+        return session.execute(union_all(*selects)).fetchall()
+
+    def neighbors(self, node_ids, direction='out', edge_types=None):
+        """Expand many nodes at once, without loading any of them.
+
+        :param list node_ids: The ids of the nodes to expand
+        :param str direction:
+            ``'out'`` (default) for the edges from the nodes, ``'in'``
+            for the edges to the nodes, or ``'both'``
+        :param list edge_types:
+            Optional list of edge labels or Edge subclasses to follow,
+            all edges are followed by default.
+        :returns:
+            A dict mapping every node_id to a list of (edge label,
+            neighbor node_id, neighbor label) tuples
+
+        .. code-block:: python
+
+            g.neighbors(['a', 'b'], 'out', ['member_of'])
+            # {'a': [('member_of', 'c', 'project')], 'b': []}
+
+        """
+
+        assert direction in ('out', 'in', 'both'),\
+            'Direction must be one of out, in or both'
+        if isinstance(node_ids, basestring):
+            node_ids = [node_ids]
+        edge_classes = Edge._get_subclasses_of_types(edge_types)
+        labels = {}
+        for cls in edge_classes:
+            src_class = Node.get_subclass_named(cls.__src_class__)
+            dst_class = Node.get_subclass_named(cls.__dst_class__)
+            labels[cls.__name__, True] = (
+                cls.get_label(), dst_class.get_label())
+            labels[cls.__name__, False] = (
+                cls.get_label(), src_class.get_label())
+        neighbors = {node_id: [] for node_id in node_ids}
+        with self.session_scope() as local:
+            rows = self._adjacent(local, node_ids, direction, edge_classes)
+            for edge_class, node_id, neighbor_id, outbound in rows:
+                edge_label, neighbor_label = labels[edge_class, outbound]
+                neighbors[node_id].append(
+                    (edge_label, neighbor_id, neighbor_label))
+        return neighbors
+
+    def shortest_path(self, src_id, dst_id, edge_types=None, max_depth=10):
+        """Find a shortest path following edges from node `src_id` to
+        node `dst_id` with a bidirectional breadth first search.
+
+        Every step expands the smaller of the two frontiers with a
+        single query over the edge tables, and only node ids are kept
+        in memory until a path is found.
+
+        :param list edge_types:
+            Optional list of edge labels or Edge subclasses to follow,
+            all edges are followed by default.
+        :param int max_depth: The maximum number of edges in the path.
+        :returns:
+            A tuple of the list of nodes and the list of edges on the
+            path, or None if there is no such path or a node on it
+            does not exist.
+
+        """
+
+        edge_classes = Edge._get_subclasses_of_types(edge_types)
+        edge_classes_named = {cls.__name__: cls for cls in edge_classes}
+        with self.session_scope() as local:
+            # node_id -> (depth, previous node_id, edge) for both searches
+            visited = {True: {src_id: (0, None, None)},
+                       False: {dst_id: (0, None, None)}}
+            frontiers = {True: [src_id], False: [dst_id]}
+            meet = src_id if src_id == dst_id else None
+            for _ in range(max_depth):
+                if meet is not None:
+                    break
+                forward = len(frontiers[True]) <= len(frontiers[False])
+                this, other = visited[forward], visited[not forward]
+                frontier = []
+                rows = self._adjacent(local, frontiers[forward],
+                                      'out' if forward else 'in',
+                                      edge_classes)
+                for edge_class, previous, node_id, outbound in rows:
+                    if node_id in this:
+                        continue
+                    edge = (edge_class, previous, node_id) if forward \
+                        else (edge_class, node_id, previous)
+                    this[node_id] = (this[previous][0] + 1, previous, edge)
+                    frontier.append(node_id)
+                    if node_id in other and (
+                            meet is None or
+                            other[node_id][0] < other[meet][0]):
+                        meet = node_id
+                if not frontier:
+                    break
+                frontiers[forward] = frontier
+
+            if meet is None:
+                return None
+
+            # Walk back to both ends from where the searches met
+            node_ids, edges = [meet], []
+            for forward in (True, False):
+                node_id = meet
+                while visited[forward][node_id][1] is not None:
+                    _, node_id, edge = visited[forward][node_id]
+                    if forward:
+                        node_ids.insert(0, node_id)
+                        edges.insert(0, edge)
+                    else:
+                        node_ids.append(node_id)
+                        edges.append(edge)
+
+            nodes = {node.node_id: node
+                     for node in self.nodes().ids(node_ids).all()}
+            if len(nodes) != len(set(node_ids)):
+                # An end of the path is not a node, e.g. src_id ==
+                # dst_id with no such node, or an edge to a missing node
+                return None
+            return (
+                [nodes[nid] for nid in node_ids],
+                [self._lookup_one(edge_classes_named[class_name], True,
+                                  src_id=edge_src_id, dst_id=edge_dst_id)
+                 for class_name, edge_src_id, edge_dst_id in edges],
+            )
+
     def get_edge_by_labels(self, src_label, edge_label, dst_label):
-        src_classes = [n for n in Node.get_subclasses()
-                       if n.get_label() == src_label]
-        dst_classes = [n for n in Node.get_subclasses()
-                       if n.get_label() == dst_label]
+        schema = get_schema()
+        src_classes = schema.nodes_labeled.get(src_label, ())
+        dst_classes = schema.nodes_labeled.get(dst_label, ())
         assert len(src_classes) == 1,\
             'No classes found with src_label {}'.format(src_label)
         assert len(dst_classes) == 1,\
             'No classes found with dst_label {}'.format(dst_label)
-        edges = [edge for edge in Edge.get_subclasses()
-                 if edge.__src_class__ == src_classes[0].__name__
-                 and edge.__dst_class__ == dst_classes[0].__name__
-                 and edge.get_label() == edge_label]
+        edges = schema.edges_linking.get((
+            src_classes[0].__name__, edge_label, dst_classes[0].__name__), ())
         assert len(edges) == 1,\
             'Expected 1 edge {}-{}->{}, found {}'.format(
                 src_label, edge_label, dst_label, len(edges))
@@ -481,8 +1034,62 @@ class PsqlGraphDriver(object):
         reloaded = []
         for e in entities:
             if isinstance(e, Edge):
-                reloaded.append(self.edges(type(e)).src(e.src_id)
-                                .dst(e.dst_id).one())
+                reloaded.append(self._lookup_one(
+                    type(e), True, src_id=e.src_id, dst_id=e.dst_id))
             else:
-                reloaded.append(self.nodes(type(e)).ids(e.node_id).one())
+                reloaded.append(self._lookup_one(
+                    type(e), True, node_id=e.node_id))
         return reloaded
+
+    def _cached_lookup(self, entity, **params):
+        """Returns the `entity` instances whose columns equal `params`.
+        The statement is compiled once per entity and set of columns,
+        see :class:`StatementCache`.
+
+        """
+        self._configure_driver_mappers()
+        with self.session_scope() as local:
+            return self._cached_instances(local, entity, params)
+
+    def _cached_instances(self, session, entity, params):
+        query = session.query(entity)
+
+        def build():
+            return query.filter(*[
+                getattr(entity, key) == bindparam(key)
+                for key in sorted(params)])
+
+        if self.statement_cache is None:
+            return build().params(**params).all()
+        statement = self.statement_cache.get(
+            (entity, tuple(sorted(params))), session.bind.dialect, build)
+        if query._autoflush:
+            session._autoflush()
+        result = statement.execute(
+            session.connection(), params, self.statement_cache.prepared)
+        return list(query.instances(result))
+
+    def _cached_query(self, query, **params):
+        """Returns `query`, which must select the entities whose columns
+        equal `params`, set to run as a :func:`_cached_lookup` as long
+        as it is not changed further.
+
+        """
+        entity = query.entity()
+        return query._with_lookup(
+            lambda session: self._cached_instances(session, entity, params))
+
+    def _lookup_one(self, entity, required=False, **params):
+        """Like :func:`_cached_lookup`, but returns a single instance or
+        None, or raises NoResultFound if `required`.
+
+        """
+        results = self._cached_lookup(entity, **params)
+        if len(results) > 1:
+            raise MultipleResultsFound(
+                'Multiple rows were found for one()')
+        if not results:
+            if required:
+                raise NoResultFound('No row was found for one()')
+            return None
+        return results[0]
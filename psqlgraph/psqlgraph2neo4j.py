@@ -94,7 +94,9 @@ class PsqlGraph2Neo4j(object):
         node_ids = dict()
         if not silent:
             i = 0
-            node_count = self.psqlgraphDriver.nodes().not_sysan({'to_delete': True}).count()
+            node_count = self.psqlgraphDriver.nodes()\
+                                             .not_sysan({'to_delete': True})\
+                                             .estimated_count()
             print("Exporting {n} nodes:".format(n=node_count))
             if node_count != 0:
                 pbar = self.start_pbar(node_count)
@@ -121,7 +123,7 @@ class PsqlGraph2Neo4j(object):
         self.close_files()
         if not silent:
             i = 0
-            edge_count = self.psqlgraphDriver.get_edge_count()
+            edge_count = self.psqlgraphDriver.edges().estimated_count()
             print("Exporting {n} edges:".format(n=edge_count))
             if edge_count != 0:
                 pbar = self.start_pbar(node_count)
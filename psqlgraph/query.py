@@ -3,15 +3,115 @@ from node import Node
 from voided_node import VoidedNode
 from voided_edge import VoidedEdge
 from edge import Edge
-from sqlalchemy.orm import Query
-from sqlalchemy import not_, or_
+from label_index import get_node_labels
+from base import property_type, property_expression, PROPERTY_TYPES
+from base import widen_property_types
+from sqlalchemy.orm import Query, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import not_, or_, and_, case, literal, inspect
+from sqlalchemy import select, union_all, cast, tuple_, false, Text
+from sqlalchemy import literal_column, exists, text, func, Float
+from sqlalchemy import BigInteger
+from sqlalchemy.dialects.postgresql import ARRAY, Any
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Executable, ClauseElement
+from sqlalchemy.sql.util import find_tables
+from collections import defaultdict
 from copy import copy
+import cPickle
+import json
 
 """
 
 """
 
 
+class Explain(Executable, ClauseElement):
+    """``EXPLAIN (FORMAT JSON)`` of a statement
+
+    """
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def compile_explain(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) {}'.format(
+        compiler.process(element.statement, **kw))
+
+
+# Tables that were never analyzed have reltuples -1 (since postgres
+# 14), their size is then estimated by the planner instead
+RELTUPLES = """
+SELECT relname, reltuples FROM pg_class
+WHERE oid = ANY(CAST(:tables AS REGCLASS[]))
+"""
+
+
+class PropertyAggregation(object):
+    """Aggregates of a query grouped by the value of a property, see
+    :func:`GraphQuery.group_by_prop`.  Every method runs one
+    ``GROUP BY`` query and returns a dict from the property value
+    to the aggregate.
+
+    """
+
+    def __init__(self, query, key):
+        self.query = query._prune_to_properties([key])
+        self.key = key
+        self.group = self.query._declared_prop_expression(key)
+
+    def _aggregate(self, aggregate):
+        return dict(self.query.order_by(None)
+                    .with_entities(self.group, aggregate)
+                    .group_by(self.group)
+                    .all())
+
+    def _typed(self, key):
+        return self.query._prune_to_properties([key])\
+                         ._declared_prop_expression(key)
+
+    def _numeric(self, key):
+        value = self._typed(key)
+        if isinstance(value.type, (BigInteger, Float)):
+            return value
+        return cast(self.query.entity()._props[key].astext, Float)
+
+    def count(self):
+        """Returns the number of results per value
+
+        """
+        return self._aggregate(func.count())
+
+    def sum(self, key):
+        """Returns the sum of property `key` per value.  Properties not
+        declared as numbers are summed as floats.
+
+        """
+        return self._aggregate(func.sum(self._numeric(key)))
+
+    def min(self, key):
+        """Returns the minimum of property `key` per value
+
+        """
+        return self._aggregate(func.min(self._typed(key)))
+
+    def max(self, key):
+        """Returns the maximum of property `key` per value
+
+        """
+        return self._aggregate(func.max(self._typed(key)))
+
+    def distinct_values(self, key):
+        """Returns a list of the distinct values of property `key` per
+        value
+
+        """
+        return self._aggregate(
+            func.array_agg(self._typed(key).distinct()))
+
+
 class GraphQuery(Query):
     """Query subclass implementing graph specific operations.
 
@@ -19,6 +119,45 @@ class GraphQuery(Query):
 
     """
 
+    # (direction, edge classes, with_neighbors) set by with_edges()
+    _with_edges = None
+    # set by cached()
+    _cached = False
+    # Function of the session returning the results of this query,
+    # used instead of compiling it, see _with_lookup()
+    _lookup = None
+    # Query state that is carried over to a query routed by the node
+    # label index, and state that refers to the polymorphic Node
+    # entity and prevents routing, see _route_by_label_index()
+    _routed_state = (
+        '_for_update_arg', '_populate_existing', '_execution_options',
+        '_params', '_yield_per', '_autoflush', '_cached', '_with_edges',
+    )
+    _unroutable_state = (
+        '_with_options', '_with_hints', '_prefixes', '_group_by',
+        '_having', '_statement',
+    )
+
+    def _clone(self):
+        query = super(GraphQuery, self)._clone()
+        # The lookup no longer returns the results of a changed query
+        query.__dict__.pop('_lookup', None)
+        return query
+
+    def __iter__(self):
+        if self._lookup is not None:
+            return iter(self._lookup(self.session))
+        if self._cached \
+           and getattr(self.session, '_query_cache', None) is not None:
+            results = self._iter_cached()
+        else:
+            results = super(GraphQuery, self).__iter__()
+        if self._with_edges is None:
+            return results
+        results = list(results)
+        self._load_edges(results, *self._with_edges)
+        return iter(results)
+
     def _iterable(self, val):
         if hasattr(val, '__iter__'):
             return val
@@ -36,6 +175,210 @@ class GraphQuery(Query):
 
         return self._joinpoint_zero().entity
 
+    def _label_column(self):
+        """Returns a column expression for the label of the entity, i.e. a
+        literal for a concrete entity or a CASE over the polymorphic
+        type column of a Node/Edge query.
+
+        """
+
+        entity = self.entity()
+        mapper = inspect(entity).mapper
+        if mapper.polymorphic_on is None:
+            return literal(entity.get_label())
+        return case(
+            {scls.__name__: scls.get_label()
+             for scls in mapper.class_.get_subclasses()},
+            value=mapper.polymorphic_on)
+
+    # ======== Caching ========
+    def cached(self):
+        """Use the driver's query result cache for this query, see the
+        ``query_cache`` argument of :class:`PsqlGraphDriver`.  Without a
+        cache this has no effect.
+
+        A cached result is used only while none of the tables the
+        query reads have been written since it was cached, and never
+        for tables the session itself has written in its current
+        transaction.  Returned entities are copies of the cached ones
+        merged into the session.
+
+        :returns: |qobj|
+
+        .. code-block:: python
+
+            g.nodes(Test).props(key1='x').path('foos').cached().all()
+
+        """
+
+        query = self._clone()
+        query._cached = True
+        return query
+
+    def _with_lookup(self, lookup):
+        """Returns this query with `lookup`, a function of the session
+        that returns the same results, used to iterate over it.  Any
+        further change to the query drops the lookup.
+
+        """
+
+        query = self._clone()
+        query._lookup = lookup
+        return query
+
+    def _iter_cached(self):
+        session = self.session
+        cache = session._query_cache
+        if self._autoflush:
+            session._autoflush()
+        # Start the transaction so that it has a table versions snapshot
+        session.connection()
+        statement = self.statement
+        tables = sorted(set(table.name for table in find_tables(statement)))
+        versions = cache.versions.versions(
+            tables, session._query_cache_versions)
+        if session._query_cache_written.intersection(tables)\
+           or versions != cache.versions.versions(tables):
+            return super(GraphQuery, self).__iter__()
+
+        compiled = statement.compile(dialect=session.get_bind().dialect)
+        key = (unicode(compiled),
+               json.dumps(compiled.params, sort_keys=True, default=repr))
+        cached = cache.get(key, versions)
+        if cached is not None:
+            return self.merge_result(cPickle.loads(cached), load=False)
+        results = list(super(GraphQuery, self).__iter__())
+        cache.set(key, versions, cPickle.dumps(results, -1))
+        return iter(results)
+
+    # ======== Counts ========
+    def _is_unfiltered(self):
+        return self._criterion is None\
+            and not self._from_obj\
+            and self._limit is None\
+            and self._offset is None\
+            and not self._distinct\
+            and not self._group_by\
+            and not self._having\
+            and len(self._entities) == 1\
+            and hasattr(self._entities[0], 'mapper')
+
+    def _planned_rows(self, query):
+        plan = self.session.execute(Explain(query.statement)).scalar()
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def estimated_count(self, exact=False):
+        """Returns a fast estimate of the number of results.
+
+        For a query on all the rows of a Node or Edge class (or of
+        all of them) this is the sum of the table sizes recorded in
+        ``pg_class.reltuples`` by the last ``ANALYZE``, otherwise the
+        row estimate of the query plan.  Both can be far off, in
+        particular before tables are analyzed.
+
+        :param bool exact: Return :func:`count` instead
+        :returns: The estimated number of results
+
+        .. code-block:: python
+
+            g.nodes().estimated_count()
+            g.nodes(Test).props(key2=1).estimated_count()
+
+        """
+
+        if exact:
+            return self.count()
+        if not self._is_unfiltered():
+            return self._planned_rows(self)
+
+        entity = self.entity()
+        mapper = inspect(entity).mapper
+        if mapper.polymorphic_on is None:
+            classes = [entity]
+        else:
+            classes = entity.get_subclasses()
+        if not classes:
+            return 0
+        tables = {cls.__table__.name: cls for cls in classes}
+        rows = self.session.execute(text(RELTUPLES), {
+            'tables': list(tables)}).fetchall()
+        count = 0
+        for name, reltuples in rows:
+            if reltuples >= 0:
+                count += int(reltuples)
+            else:
+                count += self._planned_rows(
+                    self.session.query(tables[name]))
+        return count
+
+    # ======== Paging ========
+    def _page_keys(self):
+        """Returns the default keyset to page through this query by, see
+        :func:`iter_pages`.
+
+        """
+
+        entity = self.entity()
+        mapper = inspect(entity).mapper
+        if issubclass(mapper.class_, Edge):
+            keys = [entity.src_id, entity.dst_id]
+        else:
+            keys = [entity.node_id]
+        if mapper.polymorphic_on is not None:
+            # ids are only unique within a table
+            keys.append(mapper.polymorphic_on)
+        return keys
+
+    def iter_pages(self, page_size=1000, key=None):
+        """Iterates through the results in pages, each a list of at most
+        `page_size` results, with keyset pagination, i.e.::
+
+            WHERE node_id > :last ORDER BY node_id LIMIT :page_size
+
+        Unlike paging with ``offset()``, every page is an index range
+        scan, and pages can be read in separate transactions.  Results
+        inserted or deleted between pages before the current position
+        are neither repeated nor skipped.
+
+        :param key:
+            A column or a tuple of columns that uniquely identify a
+            result.  Defaults to ``node_id`` for nodes and ``(src_id,
+            dst_id)`` for edges.
+        :returns: A generator of lists of results
+
+        .. code-block:: python
+
+            for page in g.nodes(Test).props(key2=1).iter_pages(1000):
+                with g.session_scope(can_inherit=False):
+                    ...
+
+        """
+
+        assert self._limit is None and self._offset is None,\
+            'Cannot page through a query with a limit or offset'
+        if key is None:
+            keys = self._page_keys()
+        elif isinstance(key, (tuple, list)):
+            keys = list(key)
+        else:
+            keys = [key]
+
+        query = self.order_by(None).order_by(*keys).add_columns(*keys)
+        last = None
+        while True:
+            page_query = query
+            if last is not None:
+                page_query = page_query.filter(
+                    tuple_(*keys) > tuple_(*last) if len(keys) > 1
+                    else keys[0] > last[0])
+            rows = page_query.limit(page_size).all()
+            if not rows:
+                return
+            yield [row[0] for row in rows]
+            if len(rows) < page_size:
+                return
+            last = rows[-1][1:]
+
     # ======== Edges ========
     def with_edge_to_node(self, edge_type, target_node):
         """Filter query to nodes with edges to a given node
@@ -81,6 +424,81 @@ class GraphQuery(Query):
             edge_type.src_id == source_node.node_id).subquery()
         return self.filter(self.entity().node_id == sq.c.dst_id)
 
+    def with_edges(self, direction='both', edge_types=None,
+                   with_neighbors=False):
+        """Load the edges of all the nodes returned by the query along
+        with them, filling ``node.edges_in`` and ``node.edges_out``.
+
+        The edges are loaded with one query per edge table (and
+        direction) for the whole result, instead of one query per
+        node and edge table when the edges are first accessed.
+
+        :param str direction: ``'in'``, ``'out'`` or ``'both'`` (default)
+        :param list edge_types:
+            Optional list of edge labels or Edge subclasses to load,
+            all edges are loaded by default.
+        :param bool with_neighbors:
+            Also load the nodes at the other end of the edges
+        :returns: |qobj|
+
+        .. code-block:: python
+
+            for node in g.nodes(Case).with_edges('out', ['member_of']):
+                print [edge.dst_id for edge in node.edges_out]
+
+        """
+
+        assert direction in ('out', 'in', 'both'),\
+            'Direction must be one of out, in or both'
+        query = self._clone()
+        query._with_edges = (
+            direction,
+            Edge._get_subclasses_of_types(edge_types),
+            with_neighbors,
+        )
+        return query
+
+    def _load_edges(self, results, direction, edge_classes, with_neighbors):
+        """Fill the edge relationships of the nodes in `results`, see
+        :func:`with_edges`.
+
+        """
+
+        nodes = defaultdict(list)
+        for result in results:
+            if isinstance(result, Node):
+                nodes[type(result)].append(result)
+
+        # (direction, node class attribute, edge id, this end, other end)
+        sides = []
+        if direction in ('out', 'both'):
+            sides.append(('out', '__src_class__', 'src_id', 'src', 'dst'))
+        if direction in ('in', 'both'):
+            sides.append(('in', '__dst_class__', 'dst_id', 'dst', 'src'))
+
+        for cls, cls_nodes in nodes.items():
+            for edge in edge_classes:
+                for side, class_attr, id_attr, this, other in sides:
+                    if getattr(edge, class_attr) != cls.__name__:
+                        continue
+                    rel = '_{}_{}'.format(edge.__name__, side)
+                    pending = [n for n in cls_nodes if rel not in n.__dict__]
+                    if not pending:
+                        continue
+                    ids = cast(literal([n.node_id for n in pending],
+                                       ARRAY(Text)), ARRAY(Text))
+                    query = self.session.query(edge).filter(
+                        Any(getattr(edge, id_attr), ids))
+                    if with_neighbors:
+                        query = query.options(joinedload(other))
+                    edges = defaultdict(list)
+                    for e in query:
+                        edges[getattr(e, id_attr)].append(e)
+                    for node in pending:
+                        set_committed_value(node, rel, edges[node.node_id])
+                        for e in edges[node.node_id]:
+                            set_committed_value(e, this, node)
+
     def src(self, ids):
         """Filter edges by src_id
 
@@ -132,14 +550,61 @@ class GraphQuery(Query):
             g.nodes().ids('id1').filter(...
             g.nodes().ids(['id1', 'id2']).filter(...
 
+        .. note::
+            If the session has the node label index enabled (see
+            :func:`psqlgraph.create_node_label_index`) and this is an
+            unfiltered ``Node`` query, the query is routed to the one
+            node table holding the ids when there is one.
+
         """
 
+        if hasattr(ids, '__iter__'):
+            ids = list(ids)
+            routed = self._route_by_label_index(ids)
+        else:
+            routed = self._route_by_label_index([str(ids)])
+        if routed is not None:
+            return routed.ids(ids)
+
         _id = self.entity().node_id
         if hasattr(ids, '__iter__'):
             return self.filter(_id.in_(ids))
         else:
             return self.filter(_id == str(ids))
 
+    def _route_by_label_index(self, ids):
+        """Returns a query on the single Node subclass holding `ids` if
+        this is a bare polymorphic Node query, the session has the node
+        label index enabled and the ids all have the same label.
+        Otherwise returns None.
+
+        Locking, caching and loading options are carried over to the
+        routed query.  Queries with options or clauses that refer to
+        the polymorphic Node entity are not routed.
+
+        """
+
+        if self.entity() is not Node\
+           or not getattr(self.session, '_node_label_index', False)\
+           or self._criterion is not None\
+           or self._from_obj or len(self._entities) != 1\
+           or self._order_by or self._limit or self._offset\
+           or any(getattr(self, attr) for attr in self._unroutable_state)\
+           or self._distinct not in (True, False):
+            return None
+
+        if self._autoflush:
+            self.session._autoflush()
+        labels = get_node_labels(self.session, ids)
+        if len(labels) != 1:
+            return None
+        routed = self.session.query(Node.get_subclass(labels.pop()))
+        for attr in self._routed_state:
+            setattr(routed, attr, getattr(self, attr))
+        if self._distinct:
+            routed = routed.distinct()
+        return routed
+
     def not_ids(self, ids):
         """Filter node such that returned nodes do not have node_id
 
@@ -252,10 +717,19 @@ class GraphQuery(Query):
             "type object '{}' has no attribute '{}'"
             .format(entity.__name__, link_name))
 
-    def subq_path(self, path, filters=None, __recurse_level=0):
+    def subq_path(self, path, filters=None, __recurse_level=0,
+                  strategy='join'):
         """This function will performs very similarly to `path()`.  It emits a
         query, however, that is not base on `joins` but on sub queries.
 
+        :param str strategy:
+            ``'join'`` (default) joins the first edge table and filters
+            on a subquery, which returns an entity once per matching
+            edge.  ``'exists'`` filters with a correlated ``EXISTS``
+            subquery per link instead, which postgres can plan as a
+            semi-join on the src_id/dst_id indexes and which returns
+            every entity at most once.
+
         Passing filters: Because of the warning below, you must pass
         any filters you want to filter the end of this path traversal
         with as a list of functions. The function list is a stack,
@@ -305,25 +779,220 @@ class GraphQuery(Query):
 
         # Construct the next recursive level's base query and recurse
         next_node_q = self.session.query(target_class)
-        next_node_q = next_node_q.subq_path(path, filters, __recurse_level+1)
+        filtered = bool(path)
+        next_node_q = next_node_q.subq_path(
+            path, filters, __recurse_level+1, strategy=strategy)
 
         # Pop a filter from the filter stack and apply if non-null
         if filters:
             f = filters.pop(0)
             if f is not None:
                 next_node_q = f(next_node_q)
+                filtered = True
+
+        if strategy == 'exists':
+            return self.filter(self._link_exists(
+                entity, edge, this_id, next_id, target_class,
+                next_node_q if filtered else None))
+
         next_node_sq = next_node_q.subquery()
 
         return self.filter(entity.node_id == this_id)\
                    .filter(next_id == next_node_sq.c.node_id)
 
-    def subq_without_path(self, path, filters=[], __recurse_level=0):
+    @staticmethod
+    def _link_exists(entity, edge, this_id, next_id, target_class,
+                     next_node_q):
+        """Returns an EXISTS clause for an `edge` from `entity` to a
+        `target_class` node selected by `next_node_q`, or to any node if
+        it is None
+
+        """
+
+        clause = exists().where(this_id == entity.node_id)
+        if next_node_q is not None:
+            # The node subquery must not be correlated to the
+            # enclosing query, which may be on the same node table.
+            # The filters may have joined other nodes, so the ids are
+            # taken from target_class rather than from entity()
+            next_ids = next_node_q.with_entities(
+                target_class.node_id).statement.correlate(None)
+            clause = clause.where(next_id.in_(next_ids))
+        return clause.correlate_except(edge.__table__)
+
+    def subq_without_path(self, path, filters=[], __recurse_level=0,
+                          strategy='exists'):
         """This function is similar to ``subq_path`` but will filter for
         results that **do not** have the given path/filter combination
 
+        :param str strategy:
+            ``'exists'`` (default) filters with ``NOT EXISTS``, which
+            postgres can plan as an anti-join on the src_id/dst_id
+            indexes.  ``'except'`` subtracts the results of
+            ``subq_path`` from this query with ``EXCEPT``.
+
         """
 
-        return self.except_(self.subq_path(path, filters))
+        if strategy == 'except':
+            return self.except_(self.subq_path(path, filters))
+        entity = self.entity()
+        clause = self.session.query(entity)\
+                             .subq_path(path, filters, strategy='exists')\
+                             ._criterion
+        return self.filter(not_(clause))
+
+    def _traversal_steps(self, classes, link_names, direction):
+        """Returns the (this_class, edge, this_id, next_id, next_class)
+        for every link that can be followed from `classes`, directly or
+        through other links.
+
+        """
+
+        steps, seen, todo = [], set(), list(classes)
+        while todo:
+            entity = todo.pop()
+            if entity in seen:
+                continue
+            seen.add(entity)
+            names = link_names
+            if names is None:
+                names = []
+                if direction in ('out', 'both'):
+                    names += [e.__src_dst_assoc__ for e in
+                              Edge._get_edges_with_src(entity.__name__)]
+                if direction in ('in', 'both'):
+                    names += [e.__dst_src_assoc__ for e in
+                              Edge._get_edges_with_dst(entity.__name__)]
+            for name in names:
+                try:
+                    edge, this_id, next_id, target = \
+                        self._get_link_details(entity, name)
+                except AttributeError:
+                    continue
+                out = this_id.key == 'src_id'
+                if direction == ('in' if out else 'out'):
+                    continue
+                steps.append((entity, edge, this_id, next_id, target))
+                todo.append(target)
+        return steps
+
+    def traverse(self, link_names=None, min_depth=1, max_depth=None,
+                 direction='out'):
+        """Traverses a variable length path in the graph with a single
+        recursive query, starting at the nodes selected by this query.
+
+        :param list link_names:
+            The association proxy names to follow, resolved on every
+            node class reached.  By default all links are followed.
+        :param int min_depth:
+            Only return nodes at least this many links away, counted
+            along the shortest path to them.  The starting nodes are
+            only included with a `min_depth` of 0, even if a link
+            leads back to them.
+        :param int max_depth:
+            Only follow at most this many links.  Unlimited by
+            default.
+        :param str direction:
+            ``'out'`` (default) to follow links from edge source to
+            destination, ``'in'`` to follow them from destination to
+            source, or ``'both'``.
+        :returns:
+            A query for the nodes reached, on the node class reached
+            if there is only one, otherwise on ``Node``
+
+        The recursive query collects the set of nodes reached at each
+        depth, not the paths to them, so its cost grows with the
+        number of nodes and depths rather than with the number of
+        paths.  A node's distance is the lowest depth it is reached
+        at.  Without a `max_depth` the depth is only counted up to
+        `min_depth`, which bounds the set and ends the recursion once
+        no new nodes are reached, also on cycles and with
+        ``direction='both'``.
+
+        .. code-block:: python
+
+            # All the files under a case, at any depth
+            g.nodes(Case).ids(case_id)\\
+                         .traverse(['samples', 'aliquots', 'files'])\\
+                         .props(state='live')
+
+            # All the ancestors of a file
+            g.nodes(File).ids(file_id).traverse(direction='in')
+
+        """
+
+        assert direction in ('out', 'in', 'both'),\
+            'Direction must be one of out, in or both'
+        if isinstance(link_names, basestring):
+            link_names = [link_names]
+
+        entity = self.entity()
+        mapper = inspect(entity).mapper
+        if mapper.polymorphic_on is None:
+            classes, class_name = [entity], literal(entity.__name__)
+        else:
+            classes = entity.get_subclasses()
+            class_name = mapper.polymorphic_on
+        steps = self._traversal_steps(classes, link_names, direction)
+
+        targets = set(step[-1] for step in steps)
+        if min_depth == 0:
+            targets.update(classes)
+        if not targets:
+            return self.filter(false())
+
+        # Start with the nodes selected by this query at depth 0
+        start = self.with_entities(
+            entity.node_id.label('node_id'),
+            cast(class_name, Text).label('class_name'),
+        ).subquery()
+        traversal = select([
+            start.c.node_id,
+            start.c.class_name,
+            literal_column('0').label('depth'),
+        ]).cte('traversal', recursive=True)
+
+        # Then follow any of the links from every node reached
+        links = union_all(*[
+            select([
+                cast(literal(this_class.__name__), Text).label('this_class'),
+                this_id.label('this_id'),
+                next_id.label('next_id'),
+                cast(literal(next_class.__name__), Text).label('next_class'),
+            ])
+            for this_class, edge, this_id, next_id, next_class in steps
+        ]).alias('links') if steps else None
+        if links is not None:
+            if max_depth is None:
+                depth = func.least(traversal.c.depth + 1, min_depth)
+            else:
+                depth = traversal.c.depth + 1
+            step = select([
+                links.c.next_id,
+                links.c.next_class,
+                depth,
+            ]).where(and_(
+                links.c.this_id == traversal.c.node_id,
+                links.c.this_class == traversal.c.class_name,
+            ))
+            if max_depth is not None:
+                step = step.where(traversal.c.depth < max_depth)
+            # UNION drops the rows already reached, which ends the
+            # recursion once no new (node, depth) rows are found
+            traversal = traversal.union(step)
+
+        # A node is as many links away as the shortest walk to it
+        reached = select([traversal.c.node_id]).group_by(
+            traversal.c.node_id, traversal.c.class_name,
+        ).having(func.min(traversal.c.depth) >= min_depth)
+        if len(targets) == 1:
+            target = targets.pop()
+            return self.session.query(target).filter(target.node_id.in_(
+                reached.where(traversal.c.class_name == target.__name__)))
+        polymorphic_on = inspect(Node).mapper.polymorphic_on
+        return self.session.query(Node).filter(
+            tuple_(Node.node_id, polymorphic_on).in_(
+                reached.column(traversal.c.class_name)))
 
     def path_via_assoc_proxy(self, *entities):
         """Similar to :func:`path`, but more cumbersome.
@@ -348,6 +1017,65 @@ class GraphQuery(Query):
 
         return self
 
+    # ======== Pruning ========
+    def _prune(self, predicate):
+        """Restrict a polymorphic Node/Edge query to the concrete subclasses
+        for which `predicate(subclass)` is true.
+
+        The restriction is a filter on the union's type column.  Each
+        branch of the union selects its class name as a constant, so
+        postgres evaluates the filter when planning and drops the
+        branches of all other classes: their tables are not scanned.
+        Queries on a concrete class are returned as is.
+
+        """
+
+        entity = self.entity()
+        type_column = inspect(entity).mapper.polymorphic_on
+        if type_column is None:
+            return self
+        subclasses = entity.get_subclasses()
+        names = [scls.__name__ for scls in subclasses if predicate(scls)]
+        if len(names) == len(subclasses):
+            return self
+        if not names:
+            return self.filter(false())
+        return self.filter(type_column.in_(names))
+
+    def _prune_to_properties(self, keys):
+        """Restrict a polymorphic query to the subclasses that declare all
+        of the properties `keys`.  See :func:`_prune`.
+
+        """
+
+        keys = set(keys)
+        if not keys:
+            return self
+        return self._prune(
+            lambda scls: keys.issubset(scls.__pg_properties__))
+
+    def labels(self, labels):
+        """Filter a polymorphic Node or Edge query to entities with one of
+        the given labels.  Only the tables of the matching classes are
+        scanned.
+
+        :param labels: A label or list of labels
+        :returns: |qobj|
+
+        .. code-block:: python
+
+            g.nodes().labels(['test', 'foo']).props(bar=1).count()
+
+        """
+
+        labels = set(self._iterable(labels))
+        entity = self.entity()
+        if inspect(entity).mapper.polymorphic_on is None:
+            if entity.get_label() in labels:
+                return self
+            return self.filter(false())
+        return self._prune(lambda scls: scls.get_label() in labels)
+
     # ======== Properties ========
     def props(self, props={}, **kwargs):
         """Filter query results by properties.  Results in query will all
@@ -371,10 +1099,17 @@ class GraphQuery(Query):
             g.props(key1=True, key2='Yes').count()
             g.props({'key1': True}, key2='Yes').count()
 
+        .. note::
+            On a polymorphic ``Node`` or ``Edge`` query only the
+            tables of the classes that declare all of the given
+            properties are scanned.  The same holds for :func:`prop`,
+            :func:`prop_in` and :func:`prop_range`.
+
         """
 
         assert isinstance(props, dict)
         kwargs.update(props)
+        self = self._prune_to_properties(kwargs)
         return self.filter(self.entity()._props.contains(kwargs))
 
     def not_props(self, props={}, **kwargs):
@@ -470,6 +1205,7 @@ class GraphQuery(Query):
         """
 
         assert isinstance(key, str) and isinstance(values, list)
+        self = self._prune_to_properties([key])
         return self.filter(self.entity()._props[key].astext.in_([
             str(v) for v in values]))
 
@@ -488,8 +1224,238 @@ class GraphQuery(Query):
 
         """
 
+        self = self._prune_to_properties([key])
         return self.filter(self.entity()._props.contains({key: value}))
 
+    def _prop_expression(self, key, value):
+        """Returns the typed expression for property `key`.  For a
+        property declared with ``pg_property(indexed=...)`` this is
+        the indexed expression, for other typed properties the type
+        is the declared one, see :func:`_declared_prop_type`.  Only
+        for untyped properties the type is taken from `value`.
+
+        """
+        type_ = self._common_prop_type(key)
+        if type_ is None:
+            type_ = property_type(type(value))
+        return property_expression(self.entity()._props, key, type_)
+
+    def _declared_prop_type(self, key):
+        """Returns the SQLAlchemy type of property `key` as declared with
+        pg_property by the queried class, or by all the subclasses of
+        a polymorphic query that declare it.  Mixes of numeric types
+        widen to Float, if the declared python types have no common
+        type otherwise, the type is Text.
+
+        """
+        type_ = self._common_prop_type(key)
+        return Text() if type_ is None else type_
+
+    def _common_prop_type(self, key):
+        """Like :func:`_declared_prop_type`, but returns None if the
+        property is untyped or its types have no common type.
+
+        """
+        entity = self.entity()
+        if inspect(entity).mapper.polymorphic_on is None:
+            classes = [entity]
+        else:
+            classes = entity.get_subclasses()
+        types = set()
+        for cls in classes:
+            if key in cls.__pg_indexes__:
+                types.add(type(cls.__pg_indexes__[key]))
+            elif key in cls.__pg_properties__:
+                types.update(PROPERTY_TYPES.get(type_, Text)
+                             for type_ in cls.__pg_properties__[key] or [])
+        return widen_property_types(types)
+
+    def _declared_prop_expression(self, key):
+        return property_expression(
+            self.entity()._props, key, self._declared_prop_type(key))
+
+    def prop_range(self, key, lo=None, hi=None):
+        """Filter on entities whose value of property `key` is between
+        `lo` and `hi` inclusive.  Either bound can be None to leave
+        the range open on that side.  Unlike :func:`prop`, the value
+        is compared as a number (or as whatever type the property is
+        indexed as) and can use the index created for properties
+        declared with ``pg_property(indexed=...)``.
+
+        :param str key:
+            Specifies which property to filter on.
+        :param lo: The lower bound
+        :param hi: The upper bound
+        :returns: |qobj|
+
+        .. code-block:: python
+
+            g.nodes(Test).prop_range('timestamp', 1420070400, 1451606400)
+
+        """
+
+        assert lo is not None or hi is not None, \
+            'No bounds provided to `prop_range()` filter'
+        self = self._prune_to_properties([key])
+        if lo is not None:
+            self = self.filter(self._prop_expression(key, lo) >= lo)
+        if hi is not None:
+            self = self.filter(self._prop_expression(key, hi) <= hi)
+        return self
+
+    def prop_lt(self, key, value):
+        """Filter on entities whose value of property `key` is less than
+        `value`. See :func:`prop_range`.
+
+        :returns: |qobj|
+
+        .. code-block:: python
+
+            g.nodes(Foo).prop_lt('fobble', 10).count()
+
+        """
+
+        self = self._prune_to_properties([key])
+        return self.filter(self._prop_expression(key, value) < value)
+
+    def prop_gt(self, key, value):
+        """Filter on entities whose value of property `key` is greater than
+        `value`. See :func:`prop_range`.
+
+        :returns: |qobj|
+
+        .. code-block:: python
+
+            g.nodes(Foo).prop_gt('fobble', 10).count()
+
+        """
+
+        self = self._prune_to_properties([key])
+        return self.filter(self._prop_expression(key, value) > value)
+
+    def select_props(self, keys, sysan=[]):
+        """Select only the ids, label and the given properties and system
+        annotations of the results instead of full entities.
+
+        The rows are plain named tuples with the columns ``node_id``
+        (``src_id`` and ``dst_id`` for edges), ``label``, one column
+        per property key and one ``sysan_<key>`` column per system
+        annotation key.  Properties named like the id, label or
+        ``sysan_`` columns cannot be selected.  Only the selected values are sent by the
+        database, and no ORM instances are built.  Use
+        ``row._asdict()`` for a dict.
+
+        :param list keys: The property keys to select
+        :param list sysan: The system annotation keys to select
+        :returns: |qobj|
+
+        .. code-block:: python
+
+            for node_id, label, key1, key2 in g.nodes()\\
+                    .props(key3='x').select_props(['key1', 'key2']):
+                ...
+
+            rows = g.nodes(Test).select_props(['key1'], sysan=['k'])
+            rows[0]._asdict()
+            # {'node_id': ..., 'label': 'test', 'key1': ..., 'sysan_k': ...}
+
+        """
+
+        keys = list(self._iterable(keys))
+        sysan = list(self._iterable(sysan))
+        entity = self.entity()
+        if issubclass(inspect(entity).mapper.class_, Edge):
+            ids = [entity.src_id, entity.dst_id]
+        else:
+            ids = [entity.node_id]
+        reserved = set(column.key for column in ids) | {'label'}
+        clashes = [key for key in keys
+                   if key in reserved or key.startswith('sysan_')]
+        assert not clashes, (
+            'Cannot select properties {} with `select_props()`, their '
+            'columns would clash with the id, label or sysan_ columns'
+        ).format(clashes)
+        return self.with_entities(*ids + [
+            self._label_column().label('label')
+        ] + [
+            entity._props[key].label(key) for key in keys
+        ] + [
+            entity._sysan[key].label('sysan_{}'.format(key)) for key in sysan
+        ])
+
+    # ======== Aggregation ========
+    def group_by_prop(self, key):
+        """Group the results by the value of property `key` to aggregate
+        them in the database.  The value is cast to the type declared
+        by the property's pg_property, see
+        :class:`PropertyAggregation`.
+
+        :param str key: The property to group by
+        :returns: A :class:`PropertyAggregation`
+
+        .. code-block:: python
+
+            g.nodes(Foo).group_by_prop('baz').count()
+            # {'allowed_1': 10, 'allowed_2': 3, None: 1}
+            g.nodes().group_by_prop('project').max('timestamp')
+
+        """
+
+        return PropertyAggregation(self, key)
+
+    def distinct_values(self, key):
+        """Returns the sorted distinct non-null values of property `key`
+
+        .. code-block:: python
+
+            g.nodes(Foo).distinct_values('baz')
+
+        """
+
+        self = self._prune_to_properties([key])
+        value = self._declared_prop_expression(key)
+        return [row[0] for row in self.order_by(None)
+                .with_entities(value)
+                .filter(value.isnot(None))
+                .distinct()
+                .order_by(value)]
+
+    def histogram(self, key, buckets=10):
+        """Returns the number of results per bucket of numeric property
+        `key`.  The range between the minimum and maximum values is
+        divided into `buckets` buckets of equal width.
+
+        :param str key: The property to count
+        :param int buckets: The number of buckets
+        :returns:
+            A list of `(lower bound, upper bound, count)` tuples, one
+            per bucket.  The last bucket includes its upper bound.
+
+        .. code-block:: python
+
+            g.nodes(Foo).histogram('fobble', buckets=4)
+            # [(0.0, 2.5, 3), (2.5, 5.0, 2), (5.0, 7.5, 0), (7.5, 10.0, 4)]
+
+        """
+
+        assert buckets > 0, 'histogram() needs at least one bucket'
+        self = self._prune_to_properties([key]).order_by(None)
+        value = cast(self.entity()._props[key].astext, Float)
+        lo, hi = self.with_entities(func.min(value), func.max(value)).one()
+        if lo is None:
+            return []
+        if lo == hi:
+            return [(lo, hi, self.filter(value.isnot(None)).count())]
+        bucket = func.least(func.width_bucket(value, lo, hi, buckets),
+                            buckets)
+        counts = dict(self.with_entities(bucket, func.count())
+                          .filter(value.isnot(None))
+                          .group_by(bucket)
+                          .all())
+        width = (hi - lo) / float(buckets)
+        return [(lo + i * width, lo + (i + 1) * width, counts.get(i + 1, 0))
+                for i in range(buckets)]
+
     # ======== System Annotations ========
     def sysan(self, sysans={}, **kwargs):
         """Filter query results by system_annotations.  Results in query will
@@ -0,0 +1,16 @@
+"""
+Lightweight read-only records
+
+These are plain tuples without any ORM instrumentation, used where
+full Node/Edge instances are not needed, see
+:func:`PsqlGraphDriver.stream`.
+
+"""
+from collections import namedtuple
+
+
+NodeRecord = namedtuple('NodeRecord', [
+    'node_id', 'label', 'acl', 'props', 'sysan', 'created'])
+
+EdgeRecord = namedtuple('EdgeRecord', [
+    'src_id', 'dst_id', 'label', 'acl', 'props', 'sysan', 'created'])
@@ -0,0 +1,69 @@
+"""
+Schema registry
+
+Lookups of Node and Edge subclasses by label, by name and by their
+src and dst classes.  The lookup tables are built on first use and
+dropped whenever a new model class is mapped, so every lookup is a
+dict access instead of a scan over ``__subclasses__()``.
+
+"""
+from base import CommonBase
+from sqlalchemy import event
+
+
+def group(classes, key):
+    """Returns a dict from `key(cls)` to a tuple of the classes with that
+    key, in the order of `classes`
+
+    """
+    groups = {}
+    for cls in classes:
+        groups.setdefault(key(cls), []).append(cls)
+    return {k: tuple(v) for k, v in groups.iteritems()}
+
+
+class Schema(object):
+    """Lookup tables for the given Node and Edge subclasses
+
+    """
+
+    def __init__(self, nodes, edges):
+        #: label -> Node subclasses with that label
+        self.nodes_labeled = group(nodes, lambda c: c.get_label())
+        #: class name -> Node subclass
+        self.nodes_named = {cls.__name__: cls for cls in nodes}
+        #: label -> Edge subclasses with that label
+        self.edges_labeled = group(edges, lambda c: c.get_label())
+        #: (src class name, label, dst class name) -> Edge subclasses
+        self.edges_linking = group(edges, lambda c: (
+            c.__src_class__, c.get_label(), c.__dst_class__))
+        #: Node class name -> outgoing Edge subclasses
+        self.edges_with_src = group(edges, lambda c: c.__src_class__)
+        #: Node class name -> incoming Edge subclasses
+        self.edges_with_dst = group(edges, lambda c: c.__dst_class__)
+        #: All Node and Edge subclasses
+        self.entity_classes = frozenset(nodes + edges)
+
+
+_schema = None
+
+
+def get_schema():
+    """Returns the :class:`Schema` of the currently mapped Node and Edge
+    subclasses
+
+    """
+    global _schema
+    schema = _schema
+    if schema is None:
+        from node import Node
+        from edge import Edge
+        schema = _schema = Schema(
+            Node.__subclasses__(), Edge.__subclasses__())
+    return schema
+
+
+@event.listens_for(CommonBase, 'instrument_class', propagate=True)
+def invalidate_schema(mapper, cls):
+    global _schema
+    _schema = None
@@ -0,0 +1,101 @@
+"""
+Cache of compiled lookup statements
+
+The SQL for the driver's point lookups (a node by node_id, an edge by
+src_id, dst_id and label) only depends on the entity class and on
+which filters are applied, so it is compiled once per (entity class,
+filter shape) and reused with new parameters.  Optionally the
+statements are also ``PREPARE``d once per database connection so that
+postgres skips planning them as well.
+
+"""
+import itertools
+import re
+import threading
+
+PREPARED_INFO_KEY = 'psqlgraph_prepared_statements'
+
+_PARAM = re.compile(r'%\((\w+)\)s')
+
+
+class CachedStatement(object):
+    """A compiled statement and the ``PREPARE``/``EXECUTE`` forms of it.
+
+    """
+
+    def __init__(self, name, compiled):
+        self.name = name
+        self.sql = unicode(compiled)
+        self.params = []
+
+        def positional(match):
+            if match.group(1) not in self.params:
+                self.params.append(match.group(1))
+            return '${}'.format(self.params.index(match.group(1)) + 1)
+
+        self.prepare_sql = 'PREPARE {} AS {}'.format(
+            name, _PARAM.sub(positional, self.sql))
+        self.execute_sql = 'EXECUTE {} ({})'.format(
+            name, ', '.join('%({})s'.format(p) for p in self.params))
+
+    def execute(self, connection, params, prepared=False):
+        """Execute on `connection` with `params`, a dict of the bind
+        parameter values.  If `prepared`, the statement is prepared on
+        the underlying database connection the first time it is used
+        there.
+
+        """
+        if not prepared:
+            return connection.execute(self.sql, params)
+        prepared_names = connection.info.setdefault(PREPARED_INFO_KEY, set())
+        if self.name not in prepared_names:
+            connection.execute(self.prepare_sql)
+            prepared_names.add(self.name)
+        return connection.execute(self.execute_sql, params)
+
+
+class StatementCache(object):
+    """Compiled statements keyed by (entity class, filter shape)
+
+    .. code-block:: python
+
+        cache = StatementCache()
+        statement = cache.get((Test, 'node_id'), dialect, lambda: (
+            session.query(Test)
+            .filter(Test.node_id == bindparam('node_id'))))
+        statement.execute(session.connection(), {'node_id': node_id})
+
+    """
+
+    def __init__(self, prepared=False):
+        self.prepared = prepared
+        self._statements = {}
+        self._lock = threading.Lock()
+        self._names = itertools.count()
+
+    def __len__(self):
+        return len(self._statements)
+
+    def get(self, key, dialect, build):
+        """Returns the :class:`CachedStatement` for `key`, compiling the
+        query returned by `build()` with `dialect` if it is not cached.
+
+        """
+        statement = self._statements.get(key)
+        if statement is not None:
+            return statement
+        compiled = build()._compile_context().statement.compile(
+            dialect=dialect)
+        with self._lock:
+            if key not in self._statements:
+                self._statements[key] = CachedStatement(
+                    'psqlgraph_{}'.format(next(self._names)), compiled)
+            return self._statements[key]
+
+    def clear(self):
+        """Drop all cached statements.  Statements already prepared on
+        open connections are left in place, but are not used again.
+
+        """
+        with self._lock:
+            self._statements.clear()
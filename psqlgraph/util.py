@@ -31,20 +31,48 @@ def validate(f, value, types, enum=None):
             "Value '{}' is of type {} and is not one of the allowed types "
             "for property {}: {}."
         ).format(value, type(value), f.__name__, _types))
+    # bool is a subclass of int, but cannot be cast to the type that a
+    # numeric property is indexed on
+    if isinstance(value, bool) and bool not in types \
+       and getattr(f, '__pg_indexed__', False):
+        raise ValidationError((
+            "Value '{}' is of type {} and is not one of the allowed types "
+            "for indexed property {}: {}."
+        ).format(value, type(value), f.__name__, types))
 
 
 def pg_property(*pg_args, **pg_kwargs):
+    """Declares a model property stored in _props.  Positional arguments
+    are the allowed python types, keyword arguments are:
+
+    - ``enum``: a list of allowed values
+    - ``indexed``: ``True``, a python type or a SQLAlchemy type.
+      :func:`psqlgraph.create_all` creates a B-tree index on the
+      property value cast to that type (by default the type all the
+      allowed python types cast to, Float for a mix of int and
+      float), which is used by
+      :func:`GraphQuery.prop_range` and friends
+
+    .. code-block:: python
+
+        @pg_property(int, long, indexed=True)
+        def timestamp(self, value):
+            self._set_property('timestamp', value)
+
+    """
     if len(pg_args) == 1 and isinstance(pg_args[0], FunctionType):
         fn = pg_args[0]
         fn.__pg_setter__ = True
         fn.__pg_types__ = None
         fn.__pg_enum__ = pg_kwargs.get('enum', None)
+        fn.__pg_indexed__ = False
         return fn
 
     def decorator(fn):
         fn.__pg_setter__ = True
         fn.__pg_types__ = pg_args
         fn.__pg_enum__ = pg_kwargs.get('enum', None)
+        fn.__pg_indexed__ = pg_kwargs.get('indexed', False)
 
         @wraps(fn)
         def wrapper(*args, **kwargs):
@@ -75,10 +75,18 @@ class Foo(Node):
     def baz(self, value):
         self._set_property('baz', value)
 
-    @pg_property(int)
+    @pg_property(int, indexed=True)
     def fobble(self, value):
         self._set_property('fobble', value)
 
+    @pg_property(int, long, float, indexed=True)
+    def ratio(self, value):
+        self._set_property('ratio', value)
+
+    @pg_property(int, float)
+    def weight(self, value):
+        self._set_property('weight', value)
+
 
 class FooBar(Node):
 
@@ -1,5 +1,5 @@
 """
-This is a one-time use script to set up a fresh install of Postgres 9.4
+This is a one-time use script to set up a fresh install of Postgres 9.5+
 Needs to be run as the postgres user.
 """
 
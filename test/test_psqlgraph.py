@@ -10,6 +10,7 @@ from psqlgraph import PolyEdge as PsqlEdge
 from multiprocessing import Process
 from sqlalchemy.exc import IntegrityError
 from psqlgraph.exc import ValidationError, EdgeCreationError
+from psqlgraph.hooks import is_psqlgraph_entity
 from sqlalchemy.orm.exc import FlushError
 
 from datetime import datetime
@@ -812,6 +813,19 @@ class TestPsqlGraphDriver(unittest.TestCase):
 
         self.assertIs(Edge.get_unique_subclass('test','edge1','test'), Edge1)
 
+    def test_schema_lookups(self):
+        self.assertIs(Node.get_subclass('foo'), Foo)
+        self.assertIsNone(Node.get_subclass('not_a_label'))
+        self.assertIs(Node.get_subclass_named('Foo'), Foo)
+        self.assertRaises(KeyError, Node.get_subclass_named, 'NotAClass')
+        self.assertIs(Edge.get_subclass('test_edge_2'), Edge2)
+        self.assertIsNone(Edge.get_unique_subclass('test', 'edge1', 'foo'))
+        self.assertEqual(Edge._get_edges_with_dst('Foo'), [Edge2])
+        self.assertIs(g.get_edge_by_labels('test', 'test_edge_2', 'foo'),
+                      Edge2)
+        self.assertTrue(is_psqlgraph_entity(Foo('a')))
+        self.assertFalse(is_psqlgraph_entity(VoidedNode(Foo('a'))))
+
     def test_edge_from_json(self):
         """Test edge creation from json
         """
@@ -1,10 +1,13 @@
 import uuid
 import unittest
 import logging
-from psqlgraph import PsqlGraphDriver, VoidedNode
+from psqlgraph import PsqlGraphDriver, VoidedNode, create_node_label_index
+from psqlgraph import VoidedEdge
+from psqlgraph import AsyncPsqlGraphDriver
 from psqlgraph import Node
 from psqlgraph.exc import ValidationError
 from psqlgraph.exc import SessionClosedError
+from psqlgraph.exc import EdgeCreationError
 import socket
 import sqlalchemy as sa
 
@@ -298,6 +301,78 @@ class TestPsqlGraphDriver(unittest.TestCase):
             s.commit()
             self.assertEqual(a._history.all(), [])
 
+    def test_property_set_copies_once(self):
+        nid = str(uuid.uuid4())
+        a = Test(nid, key1='a', key2=1)
+        props = a._props
+        a.key3 = 'c'
+        self.assertIs(a._props, props)
+        with g.session_scope() as s:
+            s.add(a)
+        with g.session_scope() as s:
+            a = g.nodes(Test).ids(nid).one()
+            loaded = a._props
+            a.key1 = 'b'
+            a.key2 = 2
+            self.assertIsNot(a._props, loaded)
+            self.assertEqual(loaded, {'key1': 'a', 'key2': 1, 'key3': 'c'})
+            s.flush()
+            a.key2 = 3
+        with g.session_scope() as s:
+            a = g.nodes(Test).ids(nid).one()
+            self.assertEqual(a.props['key2'], 3)
+            self.assertEqual(sorted(n.props['key2'] for n in a._history),
+                             [1, 2])
+
+    def test_cached_property_views(self):
+        nid = str(uuid.uuid4())
+        a = Test(nid, key1='a', system_annotations={'k': 1})
+        props, sysan = a.properties, a.sysan
+        self.assertIs(a.properties, props)
+        self.assertIs(a.system_annotations, sysan)
+        a.key2 = 2
+        self.assertIsNot(a.properties, props)
+        self.assertIsNone(props['key2'])
+        self.assertEqual(a.properties['key2'], 2)
+        props = a.properties
+        self.assertIs(a.properties, props)
+        snapshot = a.to_json()
+        a.key2 = 3
+        self.assertEqual(props['key2'], 2)
+        self.assertEqual(snapshot['properties']['key2'], 2)
+        a.key2 = 2
+        a.props['key1'] = 'b'
+        self.assertEqual(a.props['key1'], 'b')
+        a.sysan['k'] = 2
+        self.assertEqual(a.sysan, {'k': 2})
+        props.pop('key1')
+        self.assertEqual(a.properties['key1'], 'b')
+        with g.session_scope() as s:
+            s.add(a)
+        with g.session_scope() as s:
+            a = g.nodes(Test).ids(nid).one()
+            self.assertEqual(a.props['key2'], 2)
+            a.props = {'key2': 3}
+            self.assertEqual(a.properties['key2'], 3)
+            s.flush()
+            self.assertEqual(a.properties['key2'], 3)
+            self.assertEqual(a.sysan, {'k': 2})
+
+    def test_property_set_after_merge(self):
+        nid = str(uuid.uuid4())
+        a = Test(nid, key1='1')
+        with g.session_scope() as s:
+            m = s.merge(a)
+            s.flush()
+            a.key1 = 'x'
+            self.assertEqual(m.key1, '1')
+            self.assertNotIn(m, s.dirty)
+            m.key1 = '2'
+        with g.session_scope() as s:
+            m = g.nodes(Test).ids(nid).one()
+            self.assertEqual(m.key1, '2')
+            self.assertEqual([n.props['key1'] for n in m._history], ['1'])
+
     def test_unchanged_sysan_snapshot(self):
         nid = str(uuid.uuid4())
         a = Test(nid)
@@ -373,6 +448,39 @@ class TestPsqlGraphDriver(unittest.TestCase):
             s.flush()
             self.assertIsNone(s._flush_timestamp)
 
+    def test_batch_snapshots(self):
+        self._clear_tables()
+        g_ = PsqlGraphDriver(host, user, password, database,
+                             batch_snapshots=True)
+        g_.bulk_insert_nodes([Test('a', key2=1), Test('b', key2=2)])
+        g_.bulk_insert_edges([Edge1('a', 'b', key1='x')])
+        statements = []
+
+        @sa.event.listens_for(g_.engine, 'before_cursor_execute')
+        def receive(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with g_.session_scope() as s:
+            a, b = g_.nodes(Test).order_by(Test.node_id).all()
+            a.key2, b.key2 = 3, 4
+            s.flush()
+            edge = g_.edges(Edge1).one()
+            edge.key1 = 'y'
+            a.key2 = 5
+            s.flush()
+            self.assertEqual(len(s.new), 0)
+            self.assertEqual(
+                sorted(n.properties['key2'] for n in a._history), [1, 3])
+            self.assertEqual([n.properties['key2'] for n in b._history], [2])
+            voided_edge = g_.voided_edges().order_by(
+                VoidedEdge.key.desc()).first()
+            self.assertEqual(voided_edge.properties['key1'], 'x')
+        voided = [st for st in statements if st.startswith('INSERT')]
+        self.assertEqual(len(voided), 3)
+        self.assertEqual(len([
+            st for st in statements if 'CURRENT_TIMESTAMP' in st]), 1)
+        g_.engine.dispose()
+
     def test_custom_insert_hooks(self):
         """Test that all custom insert hooks are called."""
 
@@ -536,3 +644,233 @@ class TestPsqlGraphDriver(unittest.TestCase):
             g.nodes(Test).null_props('key1', 'key2').one()
             g.nodes(Test).null_props(['key1', 'key2'], 'key3').one()
             g.nodes(Test).null_props('key1').one()
+
+    def test_bulk_insert_nodes(self):
+        self._clear_tables()
+        nodes = [Test('a', key1='1'), Test('b', key2="tab\there"),
+                 Foo('c', bar='quote"d\\', baz='allowed_1', acl=['x', 'y'])]
+        count = g.bulk_insert_nodes(iter(nodes), batch_size=2)
+        self.assertEqual(count, 3)
+        with g.session_scope():
+            self.assertEqual(g.nodes(Test).count(), 2)
+            self.assertEqual(g.nodes(Test).ids('b').one().key2, "tab\there")
+            c = g.nodes(Foo).ids('c').one()
+            self.assertEqual(c.bar, 'quote"d\\')
+            self.assertEqual(c.acl, ['x', 'y'])
+            self.assertIsNotNone(c.created)
+
+    def test_bulk_insert_nodes_validation(self):
+        self._clear_tables()
+        with self.assertRaises(AssertionError):
+            g.bulk_insert_nodes([Test('a'), FooBar('b')])
+        foo = Foo('c')
+        foo._props = {'baz': 'not allowed'}
+        with self.assertRaises(ValidationError):
+            g.bulk_insert_nodes([foo])
+        with g.session_scope():
+            self.assertEqual(g.nodes().count(), 0)
+
+    def test_node_merge_many(self):
+        self._clear_tables()
+        with g.session_scope() as s:
+            s.merge(Test('a', key1='1', key2='2', acl=['x']))
+            s.merge(Test('b', key1='1'))
+        count = g.node_merge_many([
+            Test('a', key1='changed'),
+            Test('b', key1='1'),
+            Test('c', key3='3'),
+            Test('c', key2='2'),
+            Foo('d', bar='bar'),
+        ], batch_size=2)
+        self.assertEqual(count, 3)
+        with g.session_scope():
+            a = g.nodes(Test).ids('a').one()
+            self.assertEqual(a.key1, 'changed')
+            self.assertEqual(a.key2, '2')
+            self.assertEqual(a.acl, ['x'])
+            self.assertEqual(a._history.one().properties['key1'], '1')
+            self.assertEqual(g.nodes(Test).ids('b').one()._history.all(), [])
+            c = g.nodes(Test).ids('c').one()
+            self.assertEqual((c.key2, c.key3), ('2', '3'))
+            self.assertEqual(g.nodes(Foo).ids('d').one().bar, 'bar')
+            self.assertEqual(g.voided_nodes().count(), 1)
+
+    def test_node_merge_many_nonnull(self):
+        self._clear_tables()
+        with self.assertRaises(AssertionError):
+            g.node_merge_many([FooBar('a')])
+        g.node_merge_many([FooBar('a', bar='bar')])
+        g.node_merge_many([FooBar('a')])
+        with g.session_scope():
+            self.assertEqual(g.nodes(FooBar).one().bar, 'bar')
+
+    def test_bulk_insert_edges(self):
+        self._clear_tables()
+        g.bulk_insert_nodes([Test('a'), Test('b'), Foo('c')])
+        with g.session_scope() as s:
+            s.add(Test('d'))
+            count = g.bulk_insert_edges([
+                Edge1('a', 'b', key1='1'),
+                Edge1('b', 'd'),
+                Edge2('a', 'c'),
+            ], batch_size=1)
+        self.assertEqual(count, 3)
+        with g.session_scope():
+            self.assertEqual(g.edges(Edge1).src('a').one().key1, '1')
+            a = g.nodes(Test).ids('a').one()
+            self.assertEqual([n.node_id for n in a.foos], ['c'])
+            d = g.nodes(Test).ids('d').one()
+            self.assertEqual([n.node_id for n in d._tests], ['b'])
+
+    def test_bulk_insert_edges_missing_endpoint(self):
+        self._clear_tables()
+        g.bulk_insert_nodes([Test('a')])
+        with self.assertRaises(EdgeCreationError):
+            g.bulk_insert_edges([Edge1('a', 'a'), Edge2('a', 'missing')])
+        with g.session_scope():
+            self.assertEqual(g.edges().count(), 0)
+
+    def test_node_label_index(self):
+        self._clear_tables()
+        g_ = PsqlGraphDriver(host, user, password, database,
+                             node_label_index=True)
+        g_.node_insert(Test('a'))
+        create_node_label_index(g_.engine)
+        g_.bulk_insert_nodes([Foo('b')])
+        with g_.session_scope() as s:
+            s.add(Test('c'))
+            self.assertIs(g_.nodes().ids('a').entity(), Test)
+            self.assertIs(g_.nodes().ids(['b']).entity(), Foo)
+            self.assertEqual(g_.nodes().ids('c').one(), Test('c'))
+            self.assertEqual(g_.node_lookup_one(node_id='b').node_id, 'b')
+            self.assertIs(g_.nodes().ids(['a', 'b']).entity(), Node)
+            self.assertEqual(g_.nodes().ids(['a', 'b']).count(), 2)
+            self.assertIs(g_.nodes().props(key1='1').ids('a').entity(), Node)
+        with g_.session_scope() as s:
+            s.delete(g_.nodes().ids('a').one())
+        with g_.session_scope() as s:
+            self.assertIsNone(g_.nodes().ids('a').scalar())
+            labels = s.execute('SELECT label FROM _node_label_index '
+                               'ORDER BY node_id').fetchall()
+            self.assertEqual(labels, [('foo',), ('test',)])
+
+    def test_node_label_index_query_state(self):
+        self._clear_tables()
+        g_ = PsqlGraphDriver(host, user, password, database,
+                             node_label_index=True)
+        create_node_label_index(g_.engine)
+        g_.node_insert(Test('a'))
+        statements = []
+
+        @sa.event.listens_for(g_.engine, 'before_cursor_execute')
+        def receive(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with g_.session_scope():
+            q = g_.nodes().with_for_update().ids('a')
+            self.assertIs(q.entity(), Test)
+            self.assertEqual(q.one(), Test('a'))
+            self.assertIn('FOR UPDATE', statements[-1])
+            self.assertTrue(
+                g_.nodes().populate_existing().ids('a')._populate_existing)
+            self.assertTrue(g_.nodes().distinct().ids('a')._distinct)
+            self.assertTrue(g_.nodes().cached().ids('a')._cached)
+            self.assertIsNotNone(
+                g_.nodes().with_edges().ids('a')._with_edges)
+            self.assertIs(g_.nodes().options(sa.orm.noload('*'))
+                          .ids('a').entity(), Node)
+        sa.event.remove(g_.engine, 'before_cursor_execute', receive)
+        g_.engine.dispose()
+
+    def test_read_only_session(self):
+        g_ = PsqlGraphDriver(host, user, password, database,
+                             read_replicas=[host, {'host': host}])
+        with g_.session_scope() as s:
+            s.merge(Test('a'))
+        binds = set()
+        for i in range(2):
+            with g_.session_scope(read_only=True) as s:
+                binds.add(s.bind)
+                self.assertEqual(g_.nodes(Test).ids('a').one().node_id, 'a')
+                self.assertIsNone(s._flush_timestamp)
+        self.assertEqual(binds, set(g_.read_engines))
+        with self.assertRaises(sa.exc.InternalError):
+            with g_.session_scope(read_only=True) as s:
+                s.merge(Test('b'))
+
+    def test_read_only_least_connections(self):
+        g_ = PsqlGraphDriver(host, user, password, database,
+                             read_replicas=[host, host],
+                             read_replica_strategy='least_connections')
+        with g_.session_scope(read_only=True) as a:
+            g_.nodes().count()
+            with g_.session_scope(read_only=True, can_inherit=False) as b:
+                self.assertIsNot(a.bind, b.bind)
+
+    def test_pool_stats(self):
+        g_ = PsqlGraphDriver(host, user, password, database, pool_size=2)
+        with g_.session_scope() as a:
+            g_.nodes().count()
+            with g_.session_scope(can_inherit=False) as b:
+                g_.nodes().count()
+                self.assertIs(type(a), type(b))
+                stats = g_.pool_stats()
+                self.assertEqual(stats['size'], 2)
+                self.assertEqual(stats['checked_out'], 2)
+        stats = g_.pool_stats()
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertEqual(stats['idle'], 2)
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertGreaterEqual(stats['max_wait_time'], 0)
+        self.assertEqual(len(stats['connection_ages']), 2)
+        g_.engine.dispose()
+
+    def test_statement_cache(self):
+        self._clear_tables()
+        g_ = PsqlGraphDriver(host, user, password, database,
+                             prepared_statements=True)
+        g_.bulk_insert_nodes([Test('a', key1='1'), Test('b'), Foo('c')])
+        g_.bulk_insert_edges([Edge1('a', 'b'), Edge2('a', 'c')])
+        for i in range(2):
+            with g_.session_scope() as s:
+                s.add(Test('d'))
+                self.assertEqual(g_.node_lookup_one('a').key1, '1')
+                self.assertEqual(g_.node_lookup_one('d', label='test'),
+                                 s.query(Test).get('d'))
+                self.assertIsNone(g_.node_lookup_one('x', label='test'))
+                edge = g_.edge_lookup_one('a', 'c', label='test_edge_2')
+                self.assertEqual(edge.dst_id, 'c')
+                self.assertIsInstance(g_.edge_lookup_one('a', 'b'), Edge1)
+                self.assertEqual(g_.reload(edge), [edge])
+                self.assertEqual(g_.node_lookup_by_id('a').one().key1, '1')
+                self.assertEqual(g_.node_lookup_by_id('a').props(
+                    key1='2').all(), [])
+                self.assertEqual(sorted(
+                    e.dst_id for e in g_.edge_lookup(src_id='a')), ['b', 'c'])
+                self.assertEqual(g_.edge_lookup('a', 'c').one(), edge)
+                self.assertEqual(len(s.connection().info[
+                    'psqlgraph_prepared_statements']), 5)
+                s.rollback()
+        self.assertEqual(len(g_.statement_cache), 5)
+        g_.engine.dispose()
+
+    def test_async_driver(self):
+        self._clear_tables()
+        g_ = AsyncPsqlGraphDriver(host, user, password, database, workers=2)
+        try:
+            merges = [g_.node_merge(node_id=str(i), label='test',
+                                    properties={'key2': i})
+                      for i in range(4)]
+            self.assertEqual(set(m.get(10).node_id for m in merges),
+                             {'0', '1', '2', '3'})
+            nodes = g_.nodes(Test, lambda q: q.props(key2=1))
+            count = g_.count(Test)
+            lookup = g_.node_lookup_one(node_id='2')
+            self.assertEqual([n.node_id for n in nodes.get(10)], ['1'])
+            self.assertEqual(count.get(10), 4)
+            self.assertEqual(lookup.get(10).key2, 2)
+            with self.assertRaises(ValidationError):
+                g_.node_merge(node_id='5', label='foo',
+                              properties={'fobble': 'x'}).get(10)
+        finally:
+            g_.close()
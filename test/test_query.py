@@ -1,8 +1,14 @@
 import unittest
+import sqlalchemy as sa
 import logging
+import os
 import uuid
 from psqlgraph import Node, Edge, PsqlGraphDriver
 from psqlgraph import PolyNode, PolyEdge
+from psqlgraph import NodeRecord, EdgeRecord
+from psqlgraph.query import Explain
+from psqlgraph.exc import ValidationError
+from psqlgraph.cache import QueryCache, SharedTableVersions
 
 host = 'localhost'
 user = 'test'
@@ -138,6 +144,52 @@ class TestPsqlGraphDriver(unittest.TestCase):
                     lambda q: q.props(bar=3)
                 ]).count(), 0)
 
+    def test_subq_path_exists(self):
+        with self.g.session_scope():
+            self.assertEqual(self.g.nodes(Test)
+                             .ids(self.parent_id)
+                             .subq_path('foos', lambda q: q.props(bar=1),
+                                        strategy='exists')
+                             .count(), 1)
+            self.assertEqual(self.g.nodes(Test)
+                             .subq_path('foos', strategy='exists')
+                             .count(), 21)
+            self.assertEqual(
+                self.g.nodes(Foo)
+                .subq_path('tests.foos.tests.foos', [
+                    lambda q: q.props(bar=1),
+                    lambda q: q.ids(self.parent_id),
+                    lambda q: q.props(bar=3)
+                ], strategy='exists').count(), 4)
+            self.assertEqual(self.g.nodes(Test)
+                             .subq_path('tests.tests', strategy='exists')
+                             .count(), 5)
+
+    def test_subq_without_path_not_exists(self):
+        with self.g.session_scope():
+            query = self.g.nodes(Test).subq_without_path(
+                'tests', [lambda q: q.props(key2=1)])
+            self.assertIn('NOT (EXISTS', str(query.statement))
+            self.assertEqual(query.count(), 86 - 21)
+            self.assertEqual(query.count(), self.g.nodes(Test)
+                             .subq_without_path(
+                                 'tests', [lambda q: q.props(key2=1)],
+                                 strategy='except')
+                             .count())
+
+    def test_subq_path_join_filter(self):
+        with self.g.session_scope():
+            # The join strategy returns a row per path
+            ids = [{n.node_id for n in self.g.nodes(Test).subq_path(
+                'tests', [lambda q: q.path('foos')], strategy=strategy)}
+                for strategy in ('join', 'exists')]
+            self.assertEqual(len(ids[1]), 5)
+            self.assertEqual(ids[0], ids[1])
+            for strategy in ('exists', 'except'):
+                self.assertEqual(self.g.nodes(Test).subq_without_path(
+                    'tests', [lambda q: q.path('foos')], strategy=strategy)
+                    .count(), 81)
+
     def test_subq_without_path_no_filter(self):
         with self.g.session_scope():
             self.assertEqual(self.g.nodes(Foo)
@@ -151,3 +203,439 @@ class TestPsqlGraphDriver(unittest.TestCase):
                                  'tests',
                                  [lambda q: q.ids('test')])
                              .count(), self.g.nodes(Foo).count())
+
+    def test_traverse(self):
+        with self.g.session_scope():
+            parent = self.g.nodes(Test).ids(self.parent_id)
+            tests = parent.traverse('tests')
+            self.assertEqual(tests.entity(), Test)
+            self.assertEqual(tests.count(), 84)
+            self.assertEqual(parent.traverse(
+                'tests', min_depth=3, max_depth=3).count(), 64)
+            self.assertEqual(parent.traverse(
+                'tests', min_depth=0, max_depth=1).count(), 5)
+            nodes = parent.traverse(['tests', 'foos'], max_depth=2)
+            self.assertEqual(nodes.entity(), Node)
+            self.assertEqual(nodes.count(), 40)
+            self.assertEqual(parent.traverse().props(bar=1).count(), 21)
+            self.assertEqual(parent.traverse(
+                ['tests', '_tests'], direction='both').count(), 84)
+            self.assertEqual(parent.traverse(
+                ['tests', '_tests'], direction='both', min_depth=3,
+                max_depth=3).count(), 64)
+            self.assertEqual(self.g.nodes(Foo).props(bar=1).traverse(
+                direction='in').count(), 21)
+            self.assertEqual(self.g.nodes(Test).ids(self.lone_id)
+                             .traverse('tests').count(), 0)
+
+    def test_traverse_many_paths(self):
+        # 12 layers of 4 nodes with an edge between every pair of
+        # nodes in neighbouring layers, 4^11 paths from the first
+        # layer to the last, and an edge back closing a cycle
+        layers = [[self.lone_id]] + [
+            [str(uuid.uuid4()) for i in range(4)] for j in range(11)]
+        with self.g.session_scope() as s:
+            for layer in layers[1:]:
+                for node_id in layer:
+                    s.add(Test(node_id))
+            for layer, next_layer in zip(layers, layers[1:]):
+                for src_id in layer:
+                    for dst_id in next_layer:
+                        s.add(Edge1(src_id, dst_id))
+            s.add(Edge1(layers[-1][0], self.lone_id))
+        with self.g.session_scope():
+            lone = self.g.nodes(Test).ids(self.lone_id)
+            self.assertEqual(lone.traverse('tests').count(), 44)
+            self.assertEqual(lone.traverse(
+                'tests', min_depth=11, max_depth=11).count(), 4)
+            self.assertEqual(self.g.nodes(Test).ids(layers[1][0]).traverse(
+                'tests', min_depth=11, max_depth=12).count(), 4)
+            self.assertEqual(self.g.nodes(Test).ids(layers[-1][1]).traverse(
+                ['tests', '_tests'], direction='both').count(), 44)
+            self.assertEqual(self.g.nodes(Test).ids(layers[-1][1]).traverse(
+                ['tests', '_tests'], direction='both', min_depth=3,
+                max_depth=3).count(), 5)
+
+    def test_shortest_path(self):
+        with self.g.session_scope():
+            test = self.g.nodes(Test).ids(self.parent_id).traverse(
+                'tests', min_depth=2, max_depth=2).first()
+            foo_id = test.foos[0].node_id
+            nodes, edges = self.g.shortest_path(self.parent_id, foo_id)
+            self.assertEqual(len(nodes), 4)
+            self.assertEqual(nodes[0].node_id, self.parent_id)
+            self.assertEqual(nodes[2], test)
+            self.assertEqual(nodes[3].node_id, foo_id)
+            self.assertEqual([e.label for e in edges],
+                             ['edge1', 'edge1', 'test_edge_2'])
+            for node, edge, next_node in zip(nodes, edges, nodes[1:]):
+                self.assertEqual(edge.src_id, node.node_id)
+                self.assertEqual(edge.dst_id, next_node.node_id)
+            self.assertIsNone(self.g.shortest_path(foo_id, self.parent_id))
+            self.assertIsNone(self.g.shortest_path(
+                self.parent_id, foo_id, max_depth=2))
+            self.assertIsNone(self.g.shortest_path(
+                self.parent_id, foo_id, edge_types=['edge1']))
+            self.assertIsNone(self.g.shortest_path(
+                self.parent_id, self.lone_id))
+            nodes, edges = self.g.shortest_path(self.lone_id, self.lone_id)
+            self.assertEqual([n.node_id for n in nodes], [self.lone_id])
+            self.assertEqual(edges, [])
+            self.assertIsNone(self.g.shortest_path('missing', 'missing'))
+            self.assertIsNone(self.g.shortest_path('missing', self.lone_id))
+
+    def test_neighbors(self):
+        with self.g.session_scope():
+            children = self.g.nodes(Test).ids(self.parent_id)\
+                                         .traverse('tests', max_depth=1)\
+                                         .all()
+            child_ids = [n.node_id for n in children]
+            neighbors = self.g.neighbors(
+                [self.parent_id, self.lone_id] + child_ids)
+            self.assertEqual(neighbors[self.lone_id], [])
+            self.assertEqual(len(neighbors[self.parent_id]), 8)
+            self.assertEqual(
+                sorted(n for e, n, l in neighbors[self.parent_id]
+                       if l == 'test'), sorted(child_ids))
+            self.assertEqual(
+                {(e, l) for e, n, l in neighbors[child_ids[0]]},
+                {('edge1', 'test'), ('test_edge_2', 'foo')})
+            neighbors = self.g.neighbors(child_ids, 'in', ['edge1'])
+            for child_id in child_ids:
+                self.assertEqual(neighbors[child_id],
+                                 [('edge1', self.parent_id, 'test')])
+            neighbors = self.g.neighbors(child_ids[0], 'both', [Edge1])
+            self.assertEqual(len(neighbors[child_ids[0]]), 5)
+
+    def test_with_edges(self):
+        statements = []
+
+        def receive(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.g.session_scope():
+            sa.event.listen(self.g.engine, 'before_cursor_execute', receive)
+            try:
+                nodes = self.g.nodes(Test).props(key2=1)\
+                                          .with_edges('out',
+                                                      with_neighbors=True)\
+                                          .all()
+                self.assertEqual(len(statements), 3)
+                for node in nodes:
+                    self.assertTrue(
+                        {e.dst.label for e in node.edges_out} <=
+                        {'test', 'foo'})
+                self.assertEqual(len(statements), 3)
+                nodes = self.g.nodes().with_edges('in', ['edge1']).all()
+                self.assertEqual(len(statements), 5)
+                for node in nodes:
+                    if isinstance(node, Test):
+                        node.edges_in
+                self.assertEqual(len(statements), 5)
+                parent = [n for n in nodes if n.node_id == self.parent_id]
+                self.assertEqual(parent[0]._Edge1_in, [])
+            finally:
+                sa.event.remove(self.g.engine, 'before_cursor_execute',
+                                receive)
+
+    def test_estimated_count(self):
+        self.g.engine.execute('ANALYZE')
+        with self.g.session_scope():
+            self.assertEqual(self.g.nodes().estimated_count(),
+                             self.g.nodes().count())
+            self.assertEqual(self.g.nodes(Foo).estimated_count(),
+                             self.g.nodes(Foo).count())
+            self.assertEqual(self.g.edges().estimated_count(),
+                             self.g.edges().count())
+            estimate = self.g.nodes(Test).props(key2=1).estimated_count()
+            self.assertGreater(estimate, 0)
+            self.assertLessEqual(estimate, self.g.nodes(Test).count())
+            self.assertEqual(self.g.nodes(Test).limit(2).estimated_count(),
+                             2)
+            self.assertEqual(
+                self.g.nodes(Test).props(key2=1).estimated_count(exact=True),
+                self.g.nodes(Test).props(key2=1).count())
+
+    def test_iter_pages(self):
+        with self.g.session_scope():
+            pages = list(self.g.nodes(Test).iter_pages(10))
+            self.assertEqual([len(p) for p in pages], [10] * 8 + [6])
+            ids = [n.node_id for page in pages for n in page]
+            self.assertEqual(ids, sorted(ids))
+            self.assertEqual(len(set(ids)), self.g.nodes(Test).count())
+            pages = list(self.g.nodes().props(key2=1).iter_pages(4))
+            self.assertEqual(sum(len(p) for p in pages), 21)
+            edges = [e for page in self.g.edges().iter_pages(7) for e in page]
+            self.assertEqual(len(edges), self.g.edges().count())
+            self.assertEqual(len(set((e.src_id, e.dst_id) for e in edges)),
+                             len(edges))
+            edges = [e for page in self.g.edges(Edge2).iter_pages(
+                8, key=(Edge2.dst_id, Edge2.src_id)) for e in page]
+            self.assertEqual([e.dst_id for e in edges],
+                             sorted(e.dst_id for e in edges))
+            self.assertEqual(len(edges), self.g.edges(Edge2).count())
+
+    def test_prop_range(self):
+        with self.g.session_scope():
+            q = self.g.nodes(Test)
+            self.assertEqual(q.prop_range('key2', 1, 2).count(), 42)
+            self.assertEqual(q.prop_range('key2', lo=3).count(), 21)
+            self.assertEqual(q.prop_range('key2', hi=0).count(), 21)
+            self.assertEqual(q.prop_lt('key2', 1).count(), 21)
+            self.assertEqual(q.prop_gt('key2', 1).count(), 42)
+            for n in q.prop_range('key2', 1, 2):
+                self.assertIn(n.key2, [1, 2])
+
+    def test_prop_range_indexed(self):
+        with self.g.session_scope() as s:
+            for i in range(20):
+                self.g.node_insert(Foo(str(uuid.uuid4()), fobble=i))
+            s.flush()
+            self.assertIn('fobble', Foo.__pg_indexes__)
+            self.assertEqual(
+                self.g.nodes(Foo).prop_range('fobble', 5, 14).count(), 10)
+            self.assertEqual(self.g.nodes(Foo).prop_gt('fobble', 9).count(),
+                             10)
+            s.execute('SET LOCAL enable_seqscan = off')
+            plan = s.execute('EXPLAIN ' + str(
+                self.g.nodes(Foo).prop_lt('fobble', 3).statement.compile(
+                    dialect=self.g.engine.dialect,
+                    compile_kwargs={'literal_binds': True}))).fetchall()
+            self.assertIn('node_foo__props_fobble_idx',
+                          ' '.join(row[0] for row in plan))
+
+    def test_prop_range_indexed_mixed_types(self):
+        self.assertIsInstance(Foo.__pg_indexes__['ratio'], sa.Float)
+        with self.g.session_scope() as s:
+            for value in [1, 2L ** 40, 1.5]:
+                self.g.node_insert(Foo(str(uuid.uuid4()), ratio=value))
+            s.flush()
+            self.assertEqual(
+                self.g.nodes(Foo).prop_range('ratio', 1, 2).count(), 2)
+            self.assertEqual(
+                self.g.nodes(Foo).prop_gt('ratio', 1.5).count(), 1)
+            with self.assertRaises(ValidationError):
+                Foo(str(uuid.uuid4()), ratio=True)
+
+    def test_prop_range_declared_mixed_types(self):
+        with self.g.session_scope() as s:
+            for value in [1, 2.5, 9]:
+                self.g.node_insert(Foo(str(uuid.uuid4()), weight=value))
+            s.flush()
+            q = self.g.nodes(Foo)
+            self.assertEqual(q.prop_gt('weight', 5).count(), 1)
+            self.assertEqual(q.prop_range('weight', 1, 9).count(), 3)
+            self.assertEqual(q.prop_range('weight', 2, 3).count(), 1)
+            self.assertEqual(q.prop_lt('weight', 2.5).count(), 1)
+
+    def test_prune_by_properties(self):
+        with self.g.session_scope() as s:
+            q = self.g.nodes().props(key2=1)
+            self.assertEqual(q.count(), 21)
+            plan = str(s.execute(Explain(q.statement)).scalar())
+            self.assertIn('node_test', plan)
+            self.assertNotIn('node_foo', plan)
+            self.assertEqual(self.g.nodes().prop('bar', 1).count(), 21)
+            self.assertEqual(self.g.nodes().prop_in('bar', [1, 2]).count(),
+                             42)
+            self.assertEqual(self.g.nodes().props(key2=1, bar=1).count(), 0)
+            self.assertEqual(self.g.nodes(Test).props(key2=1).count(), 21)
+
+    def test_labels(self):
+        with self.g.session_scope():
+            self.assertEqual(self.g.nodes().labels('foo').count(), 84)
+            self.assertEqual(self.g.nodes().labels(['foo', 'test']).count(),
+                             170)
+            self.assertEqual(self.g.nodes().labels([]).count(), 0)
+            self.assertEqual(self.g.nodes(Foo).labels('foo').count(), 84)
+            self.assertEqual(self.g.nodes(Foo).labels('test').count(), 0)
+            self.assertEqual(self.g.edges().labels('edge1').count(), 84)
+
+    def test_query_cache(self):
+        cache = QueryCache()
+        cg = PsqlGraphDriver(host, user, password, database,
+                             query_cache=cache)
+
+        def query():
+            return cg.nodes(Test).props(key2=1).cached()
+
+        with cg.session_scope():
+            ids = sorted(n.node_id for n in query())
+            self.assertEqual(len(ids), 21)
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+        with cg.session_scope():
+            self.assertEqual(sorted(n.node_id for n in query()), ids)
+            self.assertEqual(query().count(), 21)
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+        with cg.session_scope():
+            self.assertEqual(query().count(), 21)
+            self.assertEqual((cache.hits, cache.misses), (2, 2))
+            node = cg.nodes(Test).props(key2=1).first()
+            node.key2 = 5
+            # the session has written node_test, the cache is bypassed
+            self.assertEqual(query().count(), 20)
+            self.assertEqual((cache.hits, cache.misses), (2, 2))
+        with cg.session_scope():
+            self.assertEqual(query().count(), 20)
+            self.assertEqual(len(query().all()), 20)
+            self.assertEqual((cache.hits, cache.misses), (2, 4))
+            # other tables are not invalidated
+            self.assertEqual(cg.nodes(Foo).cached().count(), 84)
+        with cg.session_scope():
+            self.assertEqual(cg.nodes(Foo).cached().count(), 84)
+            self.assertEqual((cache.hits, cache.misses), (3, 5))
+        cg.engine.dispose()
+
+    def test_query_cache_voided(self):
+        for batch_snapshots in (False, True):
+            cg = PsqlGraphDriver(host, user, password, database,
+                                 query_cache=True,
+                                 batch_snapshots=batch_snapshots)
+            with cg.session_scope():
+                count = cg.voided_nodes().cached().count()
+                node = cg.nodes(Test).ids(self.lone_id).one()
+                self.assertEqual(len(node._history.cached().all()),
+                                 len(node._history.all()))
+            with cg.session_scope():
+                cg.nodes(Test).ids(self.lone_id).one().key1 = str(count)
+            with cg.session_scope():
+                self.assertEqual(cg.voided_nodes().cached().count(),
+                                 count + 1)
+                node = cg.nodes(Test).ids(self.lone_id).one()
+                self.assertEqual(len(node._history.cached().all()),
+                                 count + 1)
+            cg.engine.dispose()
+
+    def test_query_cache_eviction(self):
+        cache = QueryCache(max_size=2, ttl=60)
+        for key in 'abc':
+            cache.set(key, (1,), key)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('a', (1,)))
+        self.assertEqual(cache.get('b', (1,)), 'b')
+        self.assertIsNone(cache.get('b', (2,)))
+        cache.ttl = -1
+        cache.set('d', (1,), 'd')
+        self.assertIsNone(cache.get('d', (1,)))
+
+    def test_shared_table_versions(self):
+        path = '/tmp/psqlgraph_test_versions_{}'.format(uuid.uuid4())
+        try:
+            a = SharedTableVersions(path, slots=16)
+            b = SharedTableVersions(path, slots=16)
+            before = b.snapshot()
+            self.assertEqual(b.versions(['node_test'], before), (0,))
+            a.bump(['node_test', 'node_foo_bar'])
+            self.assertEqual(b.versions(['node_test']), (1,))
+            self.assertEqual(b.versions(['node_test'], before), (0,))
+            self.assertEqual(b.versions(['node_foo_bar'], before), (1,))
+            a.close()
+            b.close()
+        finally:
+            os.remove(path)
+
+    def test_select_props(self):
+        with self.g.session_scope():
+            self.g.nodes(Test).ids(self.lone_id).one().sysan['k'] = 'v'
+        with self.g.session_scope():
+            rows = self.g.nodes(Test).props(key2=1)\
+                                     .select_props(['key2', 'key3']).all()
+            self.assertEqual(len(rows), 21)
+            for row in rows:
+                self.assertEqual(row[1:], ('test', 1, None))
+                self.assertEqual(row._asdict(), {
+                    'node_id': row.node_id, 'label': 'test',
+                    'key2': 1, 'key3': None})
+            row = self.g.nodes().ids(self.lone_id)\
+                                .select_props('key2', sysan=['k']).one()
+            self.assertEqual(row, (self.lone_id, 'test', None, 'v'))
+            self.assertEqual(row.sysan_k, 'v')
+            labels = set(r.label for r in self.g.nodes().select_props([]))
+            self.assertEqual(labels, {'test', 'foo'})
+            edge = self.g.edges(Edge2).select_props([]).first()
+            self.assertEqual(edge._fields, ('src_id', 'dst_id', 'label'))
+            self.assertEqual(edge.label, 'test_edge_2')
+            for key in ['label', 'node_id', 'sysan_k']:
+                with self.assertRaises(AssertionError):
+                    self.g.nodes().select_props([key])
+            with self.assertRaises(AssertionError):
+                self.g.edges(Edge2).select_props(['dst_id'])
+
+    def test_group_by_prop(self):
+        with self.g.session_scope():
+            for i in range(10):
+                self.g.node_insert(Foo(
+                    str(uuid.uuid4()), bar='even' if i % 2 else 'odd',
+                    fobble=i))
+        with self.g.session_scope():
+            counts = self.g.nodes(Test).group_by_prop('key2').count()
+            self.assertEqual(counts, {
+                '0': 21, '1': 21, '2': 21, '3': 21, None: 2})
+            self.assertEqual(self.g.nodes().group_by_prop('key2').count(),
+                             counts)
+            self.assertEqual(self.g.nodes(Test).props(key2=1)
+                             .group_by_prop('key2').count(), {'1': 21})
+            q = self.g.nodes(Foo).group_by_prop('bar')
+            self.assertEqual(q.sum('fobble')['even'], 25)
+            self.assertEqual(q.min('fobble')['odd'], 0)
+            self.assertEqual(q.max('fobble')['odd'], 8)
+            self.assertEqual(sorted(q.distinct_values('fobble')['even']),
+                             [1, 3, 5, 7, 9])
+            self.assertEqual(self.g.nodes(Foo).group_by_prop('fobble')
+                             .count()[3], 1)
+            self.assertEqual(self.g.nodes(Test).group_by_prop('key2')
+                             .sum('key2')['3'], 63)
+
+    def test_distinct_values(self):
+        with self.g.session_scope():
+            self.assertEqual(self.g.nodes(Test).distinct_values('key2'),
+                             ['0', '1', '2', '3'])
+            self.assertEqual(self.g.nodes().distinct_values('bar'),
+                             ['0', '1', '2', '3'])
+
+    def test_aggregate_mixed_numeric_types(self):
+        with self.g.session_scope():
+            for value in [9, 10, 2.5]:
+                self.g.node_insert(Foo(str(uuid.uuid4()), bar='w',
+                                       weight=value))
+        with self.g.session_scope():
+            q = self.g.nodes(Foo).props(bar='w').group_by_prop('bar')
+            self.assertEqual(q.max('weight'), {'w': 10})
+            self.assertEqual(q.min('weight'), {'w': 2.5})
+            self.assertEqual(self.g.nodes(Foo).distinct_values('weight'),
+                             [2.5, 9, 10])
+
+    def test_histogram(self):
+        with self.g.session_scope():
+            for i in range(11):
+                self.g.node_insert(Foo(str(uuid.uuid4()), fobble=i))
+        with self.g.session_scope():
+            self.assertEqual(self.g.nodes(Foo).histogram('fobble', 4), [
+                (0.0, 2.5, 3), (2.5, 5.0, 2), (5.0, 7.5, 3), (7.5, 10.0, 3)])
+            self.assertEqual(self.g.nodes(Test).histogram('key2', 2),
+                             [(0.0, 1.5, 42), (1.5, 3.0, 42)])
+            self.assertEqual(self.g.nodes(Foo).props(fobble=3)
+                             .histogram('fobble'), [(3.0, 3.0, 1)])
+            self.assertEqual(self.g.nodes(Test).histogram('timestamp'), [])
+
+    def test_stream_nodes(self):
+        with self.g.session_scope():
+            records = list(self.g.stream(self.g.nodes(), batch_size=7))
+            self.assertEqual(len(records), self.g.nodes().count())
+            self.assertEqual({r.label for r in records}, {'test', 'foo'})
+            record = [r for r in records if r.node_id == self.lone_id][0]
+            self.assertIsInstance(record, NodeRecord)
+            self.assertEqual(record.label, 'test')
+            self.assertEqual(record.props, {})
+            self.assertIsNotNone(record.created)
+            foos = list(self.g.stream(self.g.nodes(Foo).props(bar=1)))
+            self.assertTrue(foos)
+            self.assertTrue(all(r.props['bar'] == 1 for r in foos))
+
+    def test_stream_edges(self):
+        with self.g.session_scope():
+            records = list(self.g.stream(self.g.edges().src(self.parent_id)))
+            self.assertEqual(len(records), 8)
+            self.assertIsInstance(records[0], EdgeRecord)
+            self.assertEqual({r.label for r in records},
+                             {'edge1', 'test_edge_2'})